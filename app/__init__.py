@@ -1,15 +1,65 @@
+import os
 from flask import Flask
 from flask_cors import CORS  # 导入 Flask-CORS
 
 def create_app():
     app = Flask(__name__,static_folder='static', template_folder='templates')
     app.config['UPLOAD_FOLDER'] = 'uploads'
-    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+    # 上传大小上限（字节）。VCF 读取是流式的，但注释、预测和结果仍按整个任务一次性处理，
+    # 内存占用随变异数增长，因此默认保持 10MB，可通过环境变量调整
+    app.config['MAX_UPLOAD_SIZE'] = int(os.environ.get('MAX_UPLOAD_SIZE', 10 * 1024 * 1024))
+    app.config['MAX_CONTENT_LENGTH'] = app.config['MAX_UPLOAD_SIZE'] + 1024 * 1024
+
+    # 任务存储：'sqlite'（默认，可跨进程/重启共享）或 'memory'
+    app.config.setdefault('TASK_STORE', 'sqlite')
+    app.config.setdefault('TASK_DB_PATH', 'data/cache/tasks.db')
+    app.config.setdefault('TASK_TTL', 24 * 3600)
+
+    # 后台任务工作线程数：普通通道 / rsID 快速通道
+    app.config.setdefault('TASK_WORKERS', 2)
+    app.config.setdefault('TASK_FAST_WORKERS', 1)
+
+    # 推理后端（eager / torchscript / onnxruntime）和 intra-op 线程数（0 为默认）
+    app.config.setdefault('PREDICT_BACKEND', os.environ.get('PREDICT_BACKEND', 'eager'))
+    app.config.setdefault('PREDICT_THREADS', int(os.environ.get('PREDICT_THREADS', '0')))
+    # 可选的 int8 量化推理：'none'（默认）/ 'dynamic' / 'static'
+    app.config.setdefault('PREDICT_QUANTIZE', os.environ.get('PREDICT_QUANTIZE', 'none'))
+    # 相邻变异共享 conv1 计算，适合变异密集的 VCF
+    app.config.setdefault('PREDICT_CONV_REUSE', os.environ.get('PREDICT_CONV_REUSE', '0') == '1')
 
     # 初始化 Flask-CORS，允许跨域请求
     CORS(app, resources={r"/*": {"origins": "*"}})
 
+    from app.utils.task_store import init_task_store
+    init_task_store(
+        backend=app.config['TASK_STORE'],
+        db_path=app.config['TASK_DB_PATH'],
+        ttl=app.config['TASK_TTL'],
+    )
+
+    from app.utils.scheduler import init_scheduler
+    init_scheduler(
+        workers=app.config['TASK_WORKERS'],
+        fast_workers=app.config['TASK_FAST_WORKERS'],
+    )
+
     from .routes import main
     app.register_blueprint(main)
 
+    from app.utils.predict import configure_inference
+    configure_inference(
+        backend=app.config['PREDICT_BACKEND'],
+        threads=app.config['PREDICT_THREADS'],
+        quantize_mode=app.config['PREDICT_QUANTIZE'],
+        conv_reuse=app.config['PREDICT_CONV_REUSE'],
+    )
+
+    # 预加载共享模型，避免首个任务承担加载开销
+    if app.config.get('PRELOAD_MODEL', True):
+        try:
+            from app.utils.predict import get_model
+            get_model()
+        except Exception as e:
+            print(f"[WARNING] 模型预加载失败，将在首个任务中重试: {e}")
+
     return app
\ No newline at end of file
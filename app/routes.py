@@ -1,8 +1,9 @@
-from flask import Blueprint, request, jsonify, render_template,send_file
+from flask import Blueprint, request, jsonify, render_template,send_file, current_app
 from app.utils import process_upload
+from app.utils.task_store import get_task_store, QUEUED, PROCESSING
+from app.utils.scheduler import get_scheduler, DEFAULT_LANE, FAST_LANE
 import app.pdf_report as pdf_report
 import uuid
-import threading
 import os
 import traceback
 from fpdf import FPDF
@@ -16,8 +17,11 @@ from datetime import datetime
 
 main = Blueprint('main', __name__)
 
-# save task status
-tasks = {}
+# 支持的上传文件后缀（.vcf.bgz / .vcf.gz 需先于 .vcf 匹配）
+VCF_EXTENSIONS = ('.vcf.bgz', '.vcf.gz', '.vcf')
+
+# save task status（持久化任务存储，后端由 create_app 配置）
+tasks = get_task_store()
 
 # 在 Flask 后端添加 API 路由
 @main.route('/api/upload', methods=['POST'])
@@ -30,14 +34,16 @@ def upload_file_api():
     file = request.files['file']
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
-    # 添加文件类型检查
-    if not file.filename.lower().endswith('.vcf'):
+    # 添加文件类型检查（支持 bgzip 压缩的 VCF）
+    filename = file.filename.lower()
+    suffix = next((ext for ext in VCF_EXTENSIONS if filename.endswith(ext)), None)
+    if suffix is None:
         return jsonify({'error': 'Invalid file type'}), 400
 
     # 添加文件大小限制
-    MAX_SIZE = 10 * 1024 * 1024  # 10MB
+    max_size = current_app.config.get('MAX_UPLOAD_SIZE', 10 * 1024 * 1024)
     file.seek(0, os.SEEK_END)
-    if file.tell() > MAX_SIZE:
+    if file.tell() > max_size:
         return jsonify({'error': 'File too large'}), 400
     file.seek(0)
     
@@ -46,7 +52,7 @@ def upload_file_api():
     global UPLOAD_FOLDER
     UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    file_path = os.path.join(UPLOAD_FOLDER, f'{task_id}.vcf')
+    file_path = os.path.join(UPLOAD_FOLDER, f'{task_id}{suffix}')
     file.save(file_path)
 
     try:
@@ -56,19 +62,21 @@ def upload_file_api():
 
     # start a task 
     tasks[task_id] = {
-        'status': 'queued',
+        'status': QUEUED,
         'progress': 0,
+        'task_type': 'vcf',
         'file_path': file_path
     }
 
-    # thread in background 
-    thread = threading.Thread(
-        target=process_vcf_background,
-        args=(task_id, file_path,tasks)
+    # 加入后台任务队列
+    get_scheduler().submit(
+        task_id,
+        process_vcf_background,
+        args=(task_id, file_path, tasks),
+        lane=DEFAULT_LANE
         )
-    thread.start()
 
-    return jsonify({'status': 'queued', 'task_id': task_id}), 202
+    return jsonify({'status': 'queued', 'task_id': task_id, 'queue_position': tasks.queue_position(task_id)}), 202
 
 
 @main.route('/api/status/<task_id>', methods=['GET'])
@@ -92,6 +100,10 @@ def get_task_status_api(task_id):
             'task_type': task.get('task_type', 'unknown') 
         }
 
+        if task['status'] == QUEUED:
+            # 排队顺序保存在任务存储中，多个 worker 进程看到的位置一致
+            response['queue_position'] = tasks.queue_position(task_id)
+
         if task['status'] == 'completed':
             response['result'] = task.get('result')
 
@@ -103,6 +115,34 @@ def get_task_status_api(task_id):
         return jsonify({'error': '服务器内部错误，请查看终端日志'}), 500
 
 
+@main.route('/api/cancel/<task_id>', methods=['POST'])
+def cancel_task_api(task_id):
+    task = tasks.get(task_id)
+    if not task:
+        return jsonify({'error': 'Invalid task ID'}), 404
+
+    # 取消标记写入任务存储：任务可能排在其他 worker 进程的队列中，
+    # 该进程取到任务时会发现状态已不是 queued 而跳过
+    cancelled = tasks.transition(task_id, QUEUED, {
+        'status': 'failed',
+        'progress': 100,
+        'error_message': '任务已取消',
+    })
+    if not cancelled:
+        return jsonify({'error': '任务已开始执行或已结束，无法取消'}), 409
+
+    # 任务在本进程队列中时直接移除
+    get_scheduler().cancel(task_id)
+    file_path = task.get('file_path')
+    if file_path and os.path.exists(file_path):
+        try:
+            os.remove(file_path)
+        except Exception as e:
+            print(f"[WARNING] 删除文件失败: {file_path}，原因: {e}")
+
+    return jsonify({'status': 'cancelled', 'task_id': task_id})
+
+
 @main.route('/api/query_rsid', methods=['POST'])
 def query_rsid_api():
     data = request.get_json()
@@ -120,14 +160,20 @@ def query_rsid_api():
 
     task_id = str(uuid.uuid4())
     tasks[task_id] = {
-        'status': 'queued',
-        'progress': 0
+        'status': QUEUED,
+        'progress': 0,
+        'task_type': 'rsid'
     }
 
-    thread = threading.Thread(target=process_rsid_background, args=(task_id, rsid, tasks))
-    thread.start()
+    # rsID 查询走快速通道，不会排在大 VCF 任务之后
+    get_scheduler().submit(
+        task_id,
+        process_rsid_background,
+        args=(task_id, rsid, tasks),
+        lane=FAST_LANE
+        )
 
-    return jsonify({'status': 'queued', 'task_id': task_id}), 202
+    return jsonify({'status': 'queued', 'task_id': task_id, 'queue_position': tasks.queue_position(task_id)}), 202
 
 
 @main.route('/api/results', methods=['GET'])
@@ -534,6 +580,38 @@ def generate_report():
             except Exception as e:
                 print(f"删除临时文件失败: {e}")
 
+@main.route('/api/model_info', methods=['GET'])
+def model_info_api():
+    from app.utils.predict import get_model_info
+    return jsonify(get_model_info())
+
+
+@main.route('/api/queue_stats', methods=['GET'])
+def queue_stats_api():
+    # 排队 / 执行中的数量来自共享的任务存储；local 为当前 worker 进程内调度器的状态
+    stats = tasks.queue_counts()
+    stats['local'] = get_scheduler().stats()
+    return jsonify(stats)
+
+
+@main.route('/api/vep_cache_stats', methods=['GET'])
+def vep_cache_stats_api():
+    from app.utils.vep_cache import get_vep_cache
+    return jsonify(get_vep_cache().get_stats())
+
+
+@main.route('/api/prediction_cache_stats', methods=['GET'])
+def prediction_cache_stats_api():
+    from app.utils.prediction_cache import get_cache_stats
+    return jsonify(get_cache_stats())
+
+
+@main.route('/api/db_stats', methods=['GET'])
+def db_stats_api():
+    from app.utils.db_pool import get_stats
+    return jsonify(get_stats())
+
+
 @main.route('/')
 def index():
     return render_template('index.html')
@@ -550,15 +628,22 @@ def uploaded_file(filename):
 # ----------------------------
 
 from app.utils.variant_utils import process_variants
+from app.utils import db_pool
 import os
 import traceback
 
 def process_vcf_background(task_id, file_path, tasks):
     try:
+        if not tasks.transition(task_id, QUEUED, {'status': PROCESSING, 'task_type': 'vcf', 'progress': 10}):
+            print(f"[INFO][{task_id}] 任务已取消，跳过")
+            return
         print(f"[INFO][{task_id}] 开始解析 VCF 文件: {file_path}")
-        tasks[task_id]['task_type'] = 'vcf'
-        tasks[task_id]['progress'] = 10
-        variants = process_upload.process_vcf(file_path)
+
+        def update_progress(done, total):
+            # VEP 分片注释占 10% - 20% 的进度
+            tasks[task_id]['progress'] = 10 + int(10 * done / total)
+
+        variants = process_upload.process_vcf(file_path, progress_callback=update_progress)
         tasks[task_id]['progress'] = 20
         print(f"[INFO][{task_id}] VCF 文件解析完成，变异数: {len(variants)}")
         process_variants(task_id, variants, tasks, file_path)
@@ -572,11 +657,17 @@ def process_vcf_background(task_id, file_path, tasks):
         tasks[task_id]['task_type'] = 'vcf'
         tasks[task_id]['error_message'] = str(e)
 
+    finally:
+        # 工作线程长期存在，每个任务结束时释放其持有的只读连接
+        db_pool.close_thread_connections()
+
 
 def process_rsid_background(task_id, rsid, tasks):
     try:
+        if not tasks.transition(task_id, QUEUED, {'status': PROCESSING, 'task_type': 'rsid'}):
+            print(f"[INFO][{task_id}] 任务已取消，跳过")
+            return
         print(f"[INFO][{task_id}] 开始处理 rsID : {rsid}")
-        tasks[task_id]['task_type'] = 'rsid'
         variants = process_upload.process_rsid(rsid)
         tasks[task_id]['progress'] = 10
         print(f"[INFO][{task_id}] rsID 转换为变异记录完成")
@@ -592,4 +683,8 @@ def process_rsid_background(task_id, rsid, tasks):
         tasks[task_id]['task_type'] = 'rsid'
         tasks[task_id]['error_message'] = str(e)
 
+    finally:
+        # 工作线程长期存在，每个任务结束时释放其持有的只读连接
+        db_pool.close_thread_connections()
+
 
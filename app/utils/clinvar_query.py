@@ -1,5 +1,11 @@
-import sqlite3
 import re
+from app.utils import db_pool
+
+PRIMARY_DB = "data/clinvar/clinvar.db"
+SECONDARY_DB = "data/clinvar/variant_summary.db"
+
+# 批量查询时每个 IN (...) 列表的最大长度（低于 SQLite 变量数上限）
+BULK_CHUNK_SIZE = 400
 
 def normalize_variant_id(variant_id):
     """
@@ -25,24 +31,49 @@ def normalize_variant_id(variant_id):
         return 'unknown', variant_id
 
 
+def _format_primary(chrom, pos, rsid, ref, alt, gene, clndn, clnsig):
+    return {
+        'Chromosome': f'chr{chrom}',
+        'Pos': pos,
+        'ID': f'rs{rsid}' if rsid else 'NA',
+        'Ref': ref,
+        'Alt': alt,
+        'Gene': gene,
+        'ClinvarDiseaseName': clndn or 'NA',
+        'ClinicalSignificance': clnsig or 'Unknown',
+    }
+
+
+def _format_secondary(clnsig, rsid, chrom, start, ref, alt):
+    return {
+        'Chromosome': f'chr{chrom}',
+        'Pos': start,
+        'ID': rsid if rsid else 'NA',
+        'Ref': ref,
+        'Alt': alt,
+        'Gene': None,
+        'ClinvarDiseaseName': 'NA',
+        'ClinicalSignificance': clnsig or 'Unknown',
+    }
+
+
 def query_clinvar(variant_id, db_path, db_type='primary'):
     """
     db_type: 'primary' 表示第一个库（字段包括 chrom, pos, rsid, ref, alt 等）
              'secondary' 表示备用库（字段包括 Chromosome, Start, rsid, ReferenceAlleleVCF, AlternateAlleleVCF 等）
     """
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
         id_type, parsed = normalize_variant_id(variant_id)
         rows = []
 
         if db_type == 'primary':
             if id_type == 'rs':
-                cursor.execute("SELECT * FROM clinvar WHERE rsid = ?", (parsed,))
+                cursor = db_pool.execute(db_path, "SELECT * FROM clinvar WHERE rsid = ?", (parsed,))
             elif id_type == 'loc':
                 chrom, pos = parsed
-                cursor.execute("SELECT * FROM clinvar WHERE chrom = ? AND pos = ?", (chrom, pos))
+                cursor = db_pool.execute(db_path, "SELECT * FROM clinvar WHERE chrom = ? AND pos = ?", (chrom, pos))
+            else:
+                return None
             rows = cursor.fetchall()
 
             if not rows:
@@ -50,27 +81,17 @@ def query_clinvar(variant_id, db_path, db_type='primary'):
 
             # 主库字段顺序为：
             # chrom, pos, rsid, ref, alt, gene, consequence, af_exac, af_tgp, clndn, clnsig
-            row = rows[0]
-            chrom, pos, rsid, ref, alt, gene, _, _, _, clndn, clnsig = row
-
-            return {
-                'Chromosome': f'chr{chrom}',
-                'Pos': pos,
-                'ID': f'rs{rsid}' if rsid else 'NA',
-                'Ref': ref,
-                'Alt': alt,
-                'Gene': gene,
-                'ClinvarDiseaseName': clndn or 'NA',
-                'ClinicalSignificance': clnsig or 'Unknown',
-            }
+            chrom, pos, rsid, ref, alt, gene, _, _, _, clndn, clnsig = rows[0]
+            return _format_primary(chrom, pos, rsid, ref, alt, gene, clndn, clnsig)
 
         elif db_type == 'secondary':
             if id_type == 'rs':
-                
-                cursor.execute("SELECT * FROM clinvar WHERE rsid = ?", (f'rs{parsed}',))
+                cursor = db_pool.execute(db_path, "SELECT * FROM clinvar WHERE rsid = ?", (f'rs{parsed}',))
             elif id_type == 'loc':
                 chrom, pos = parsed
-                cursor.execute("SELECT * FROM clinvar WHERE Chromosome = ? AND Start = ?", (chrom, pos))
+                cursor = db_pool.execute(db_path, "SELECT * FROM clinvar WHERE Chromosome = ? AND Start = ?", (chrom, pos))
+            else:
+                return None
             rows = cursor.fetchall()
 
             if not rows:
@@ -78,19 +99,8 @@ def query_clinvar(variant_id, db_path, db_type='primary'):
 
             # 次库字段为：
             # GeneID, ClinicalSignificance, rsid, Chromosome, Start, Stop, ReferenceAlleleVCF, AlternateAlleleVCF
-            row = rows[0]
-            gene, clnsig, rsid, chrom, start, _, ref, alt = row
-
-            return {
-                'Chromosome': f'chr{chrom}',
-                'Pos': start,
-                'ID': rsid if rsid else 'NA',
-                'Ref': ref,
-                'Alt': alt,
-                'Gene': None,
-                'ClinvarDiseaseName': 'NA',
-                'ClinicalSignificance': clnsig or 'Unknown',
-            }
+            _, clnsig, rsid, chrom, start, _, ref, alt = rows[0]
+            return _format_secondary(clnsig, rsid, chrom, start, ref, alt)
 
         else:
             return None
@@ -98,16 +108,14 @@ def query_clinvar(variant_id, db_path, db_type='primary'):
     except Exception as e:
         print(f"[ERROR] 查询失败: {e}")
         return None
-    finally:
-        conn.close()
 
 def query_with_fallback(variant_id):
     try:    
-        result = query_clinvar(variant_id, db_path="data/clinvar/clinvar.db", db_type='primary')
+        result = query_clinvar(variant_id, db_path=PRIMARY_DB, db_type='primary')
         if result:
             return result
 
-        result = query_clinvar(variant_id, db_path="data/clinvar/variant_summary.db", db_type='secondary')
+        result = query_clinvar(variant_id, db_path=SECONDARY_DB, db_type='secondary')
         if result:
             result['Note'] = '来自次级数据库'
             return result
@@ -116,3 +124,106 @@ def query_with_fallback(variant_id):
         print(f"[ERROR] 查询失败: {e}")
         return {'variant_id': variant_id, 'clinvar': None}
 
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _bulk_query_primary(rs_keys, loc_keys, db_path, chunk_size):
+    """返回 {('rs', rs号): row_dict} 与 {('loc', (chrom, pos)): row_dict}"""
+    found = {}
+    columns = "chrom, pos, rsid, ref, alt, gene, clndn, clnsig"
+
+    for chunk in _chunks(rs_keys, chunk_size):
+        placeholders = ",".join("?" for _ in chunk)
+        cursor = db_pool.execute(
+            db_path, f"SELECT {columns} FROM clinvar WHERE rsid IN ({placeholders})", chunk)
+        for row in cursor:
+            found.setdefault(('rs', str(row[2])), _format_primary(*row))
+
+    # 每个位点占两个变量
+    for chunk in _chunks(loc_keys, chunk_size // 2):
+        placeholders = ",".join("(?, ?)" for _ in chunk)
+        params = [v for key in chunk for v in key]
+        cursor = db_pool.execute(
+            db_path, f"SELECT {columns} FROM clinvar WHERE (chrom, pos) IN (VALUES {placeholders})", params)
+        for row in cursor:
+            found.setdefault(('loc', (str(row[0]), int(row[1]))), _format_primary(*row))
+
+    return found
+
+
+def _bulk_query_secondary(rs_keys, loc_keys, db_path, chunk_size):
+    found = {}
+    columns = "ClinicalSignificance, rsid, Chromosome, Start, ReferenceAlleleVCF, AlternateAlleleVCF"
+
+    for chunk in _chunks(rs_keys, chunk_size):
+        placeholders = ",".join("?" for _ in chunk)
+        cursor = db_pool.execute(
+            db_path, f"SELECT {columns} FROM clinvar WHERE rsid IN ({placeholders})",
+            [f'rs{k}' for k in chunk])
+        for row in cursor:
+            rsid = str(row[1] or '')
+            found.setdefault(('rs', rsid[2:] if rsid.lower().startswith('rs') else rsid), _format_secondary(*row))
+
+    for chunk in _chunks(loc_keys, chunk_size // 2):
+        placeholders = ",".join("(?, ?)" for _ in chunk)
+        params = [v for key in chunk for v in key]
+        cursor = db_pool.execute(
+            db_path, f"SELECT {columns} FROM clinvar WHERE (Chromosome, Start) IN (VALUES {placeholders})", params)
+        for row in cursor:
+            found.setdefault(('loc', (str(row[2]), int(row[3]))), _format_secondary(*row))
+
+    return found
+
+
+def annotate_bulk(variant_ids, primary_db=PRIMARY_DB, secondary_db=SECONDARY_DB, chunk_size=BULK_CHUNK_SIZE):
+    """
+    批量 ClinVar 注释：将任务中全部 rsID 和 chrom:pos 按块组成 IN (...) 列表，
+    一次性在主库中查询，只有未命中的变异再查询次级库。
+    返回 {variant_id: clinvar_data}，未找到的变异不出现在结果中。
+    """
+    keys = {}
+    for variant_id in variant_ids:
+        if not variant_id:
+            continue
+        try:
+            id_type, parsed = normalize_variant_id(str(variant_id))
+        except ValueError:
+            continue
+        if id_type in ('rs', 'loc'):
+            keys[variant_id] = (id_type, parsed)
+
+    results = {}
+    if not keys:
+        return results
+
+    def lookup(pending, db_path, query_fn):
+        rs_keys = sorted({p for t, p in pending.values() if t == 'rs'})
+        loc_keys = sorted({p for t, p in pending.values() if t == 'loc'})
+        try:
+            return query_fn(rs_keys, loc_keys, db_path, chunk_size)
+        except Exception as e:
+            print(f"[ERROR] 批量查询失败 ({db_path}): {e}")
+            return {}
+
+    found = lookup(keys, primary_db, _bulk_query_primary)
+    misses = {}
+    for variant_id, key in keys.items():
+        if key in found:
+            results[variant_id] = dict(found[key])
+        else:
+            misses[variant_id] = key
+
+    if misses:
+        found = lookup(misses, secondary_db, _bulk_query_secondary)
+        for variant_id, key in misses.items():
+            if key in found:
+                result = dict(found[key])
+                result['Note'] = '来自次级数据库'
+                results[variant_id] = result
+
+    print(f"[INFO] 批量 ClinVar 注释: 共 {len(keys)} 个变异，主库命中 {len(keys) - len(misses)}，"
+          f"次级库命中 {len(results) - (len(keys) - len(misses))}")
+    return results
@@ -0,0 +1,86 @@
+import sqlite3
+import threading
+import time
+import os
+
+# 只读参考库（ClinVar / RegulomeDB / PRS）的连接参数
+MMAP_SIZE = 256 * 1024 * 1024   # 256MB 内存映射
+CACHE_SIZE_KB = 64 * 1024       # 64MB 页缓存
+CACHED_STATEMENTS = 256         # 每个连接保留的预编译语句数
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_stats = {
+    'connections_opened': 0,
+    'pool_hits': 0,
+    'queries': 0,
+    'query_time': 0.0,
+}
+
+
+def _open_readonly(db_path):
+    abs_path = os.path.abspath(db_path)
+    if not os.path.exists(abs_path):
+        raise FileNotFoundError(f"数据库不存在: {abs_path}")
+    uri = f"file:{abs_path}?mode=ro&immutable=1"
+    conn = sqlite3.connect(uri, uri=True, cached_statements=CACHED_STATEMENTS)
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    return conn
+
+
+def get_connection(db_path):
+    """
+    返回当前线程对 db_path 的只读连接，首次调用时打开并复用。
+    每个线程持有独立连接，可在 routes.py 的后台线程中安全使用。
+    """
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+
+    conn = conns.get(db_path)
+    if conn is not None:
+        with _stats_lock:
+            _stats['pool_hits'] += 1
+        return conn
+
+    conn = _open_readonly(db_path)
+    conns[db_path] = conn
+    with _stats_lock:
+        _stats['connections_opened'] += 1
+    return conn
+
+
+def execute(db_path, sql, params=()):
+    """在池化连接上执行查询并记录耗时，返回 cursor"""
+    conn = get_connection(db_path)
+    start = time.perf_counter()
+    cursor = conn.execute(sql, params)
+    elapsed = time.perf_counter() - start
+    with _stats_lock:
+        _stats['queries'] += 1
+        _stats['query_time'] += elapsed
+    return cursor
+
+
+def close_thread_connections():
+    """关闭当前线程持有的所有连接"""
+    conns = getattr(_local, 'conns', None)
+    if not conns:
+        return
+    for conn in conns.values():
+        try:
+            conn.close()
+        except Exception:
+            pass
+    conns.clear()
+
+
+def get_stats():
+    """返回连接池命中次数、查询次数和平均查询耗时（毫秒）"""
+    with _stats_lock:
+        stats = dict(_stats)
+    total = stats['connections_opened'] + stats['pool_hits']
+    stats['hit_rate'] = stats['pool_hits'] / total if total else 0.0
+    stats['avg_query_ms'] = stats['query_time'] / stats['queries'] * 1000 if stats['queries'] else 0.0
+    return stats
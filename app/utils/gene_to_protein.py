@@ -2,9 +2,43 @@ import subprocess
 import requests
 import time
 import urllib.parse
-import json
 import re
 import os
+import gzip
+import math
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from app.utils.uniprot_store import get_uniprot_store, get_uniprot_cache
+
+# VEP 安装与缓存路径
+VEP_SCRIPT = "/mnt/c/Users/10188/bio2502project/ensembl-vep/vep"
+VEP_CACHE_DIR = "/mnt/c/Users/10188/bio2502project/.vep"
+VEP_FASTA = "/mnt/c/Users/10188/bio2502project/data/GRCh38/Homo_sapiens.GRCh38.dna.primary_assembly.fa"
+VEP_ASSEMBLY = "GRCh38"
+
+# 分片并行注释：并行度和每个分片的最少变异数
+VEP_PARALLELISM = int(os.environ.get("VEP_PARALLELISM", os.cpu_count() or 1))
+VEP_MIN_SHARD_SIZE = 2000
+
+
+def vep_annotation_args():
+    """VEP 注释参数（不含输入输出），子进程模式和常驻服务模式共用"""
+    return [
+        "--cache",
+        "--offline",
+        "--dir_cache", VEP_CACHE_DIR,
+        "--assembly", VEP_ASSEMBLY,
+        "--symbol",
+        "--uniprot",
+        "--fasta", VEP_FASTA,
+        "--hgvs",
+        "--protein",
+        "--no_stats",
+        "--everything",
+    ]
+
 
 def run_vep(input_vcf, output_file):
     """
@@ -16,24 +50,11 @@ def run_vep(input_vcf, output_file):
     print("[DEBUG] 输出目录:", output_dir)
     print("[DEBUG] 输出文件名:", output_name)
 
-    cmd = [
-        "perl", "/mnt/c/Users/10188/bio2502project/ensembl-vep/vep",
-        "-i", input_vcf,
-        "--cache",
-        "--offline",
-        "--dir_cache", "/mnt/c/Users/10188/bio2502project/.vep",
-        "--assembly", "GRCh38",
-        "--symbol",
-        "--uniprot",
-        "--fasta", "/mnt/c/Users/10188/bio2502project/data/GRCh38/Homo_sapiens.GRCh38.dna.primary_assembly.fa",
-        "--hgvs",
-        "--protein",
-        "--no_stats",
-        "--everything",
+    cmd = ["perl", VEP_SCRIPT, "-i", input_vcf] + vep_annotation_args() + [
         "--verbose",
         "-o", output_name,
         "--force_overwrite"
- ]
+    ]
     
     try:
         result = subprocess.run(cmd, cwd=output_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
@@ -55,84 +76,204 @@ def run_vep(input_vcf, output_file):
         raise RuntimeError(error_msg)
 
 
-def parse_vep_output(vep_file, verbose=False):
-    variants = []
-    headers = None
-    idx_map = {}
+def _open_vcf(path):
+    return gzip.open(path, "rt") if path.endswith((".gz", ".bgz")) else open(path)
+
+
+def split_vcf(input_vcf, shard_dir, shard_size):
+    """按变异数将 VCF 切分为多个分片（每个分片带完整表头），返回分片路径列表"""
+    shard_paths = []
+    header = []
+    out = None
+    count = 0
+    with _open_vcf(input_vcf) as f:
+        for line in f:
+            if line.startswith("#"):
+                header.append(line)
+                continue
+            if not line.strip():
+                continue
+            if out is None or count >= shard_size:
+                if out:
+                    out.close()
+                path = os.path.join(shard_dir, f"shard_{len(shard_paths):04d}.vcf")
+                shard_paths.append(path)
+                out = open(path, "w")
+                out.writelines(header)
+                count = 0
+            out.write(line)
+            count += 1
+    if out:
+        out.close()
+    return shard_paths
+
+
+def merge_vep_outputs(shard_outputs, output_file):
+    """按分片顺序合并 VEP TSV 输出，表头只保留第一个分片的"""
+    with open(output_file, "w") as out:
+        for i, path in enumerate(shard_outputs):
+            if not os.path.exists(path):
+                raise RuntimeError(f"VEP 分片输出缺失: {path}")
+            with open(path) as f:
+                for line in f:
+                    if line.startswith("#") and i > 0:
+                        continue
+                    out.write(line)
+
+
+def run_vep_sharded(input_vcf, output_file, record_count, parallelism=VEP_PARALLELISM,
+                    progress_callback=None):
+    """
+    将大型 VCF 切分为分片，用多个 VEP 进程并行注释后按分片顺序合并输出。
+    progress_callback(done, total) 在每个分片完成时调用。
+    """
+    parallelism = max(1, parallelism)
+    shard_size = max(VEP_MIN_SHARD_SIZE, math.ceil(record_count / parallelism))
+    if record_count <= shard_size:
+        run_vep(input_vcf, output_file)
+        if progress_callback:
+            progress_callback(1, 1)
+        return
+
+    shard_dir = tempfile.mkdtemp(prefix="vep_shards_", dir=os.path.dirname(output_file) or None)
+    try:
+        shard_paths = split_vcf(input_vcf, shard_dir, shard_size)
+        shard_outputs = [f"{path}.tsv" for path in shard_paths]
+        total = len(shard_paths)
+        print(f"[DEBUG] VCF 切分为 {total} 个分片（每片最多 {shard_size} 条），并行度 {parallelism}")
+
+        done = 0
+        with ThreadPoolExecutor(max_workers=min(parallelism, total)) as executor:
+            futures = [executor.submit(run_vep, path, out) for path, out in zip(shard_paths, shard_outputs)]
+            for future in as_completed(futures):
+                future.result()
+                done += 1
+                if progress_callback:
+                    progress_callback(done, total)
+
+        merge_vep_outputs(shard_outputs, output_file)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+
+# 只从 Extra 列中提取需要的键，不构建完整字典
+_EXTRA_FIELD_RE = re.compile(r"(?:^|;)(SWISSPROT|UniProtKB_ID|HGVSp|CANONICAL|MANE_SELECT|IMPACT)=([^;]*)")
+
+# 转录本选择策略：
+# 'mane'        优先 MANE Select，其次 canonical，再按影响程度
+# 'canonical'   优先 VEP canonical 转录本，再按影响程度
+# 'most_severe' 选择 IMPACT 最高的转录本
+# 'all'         保留全部转录本（旧行为）
+TRANSCRIPT_POLICIES = ('mane', 'canonical', 'most_severe', 'all')
+TRANSCRIPT_POLICY = os.environ.get("VEP_TRANSCRIPT_POLICY", "mane")
+_IMPACT_RANK = {'HIGH': 0, 'MODERATE': 1, 'LOW': 2, 'MODIFIER': 3}
+
+
+def _extract_extra(extra):
+    fields = dict.fromkeys(("SWISSPROT", "UniProtKB_ID", "HGVSp", "CANONICAL", "MANE_SELECT", "IMPACT"))
+    for key, value in _EXTRA_FIELD_RE.findall(extra):
+        fields[key] = value
+    return fields
+
+
+def select_transcript(records, policy=TRANSCRIPT_POLICY):
+    """
+    从同一变异的多条转录本记录中按策略选出一条可用于蛋白分析的记录，
+    返回列表（'all' 策略返回全部记录，无可用记录时返回空列表）。
+    """
+    if policy == 'all':
+        return list(records)
+    if policy not in TRANSCRIPT_POLICIES:
+        raise ValueError(f"未知的转录本选择策略: {policy}")
+
+    usable = [r for r in records if r.get('protein_id') and (r.get('hgvs_p') or '').startswith('p.')]
+    if not usable:
+        return []
+
+    def rank(item):
+        i, r = item
+        severity = _IMPACT_RANK.get(r.get('impact'), len(_IMPACT_RANK))
+        if policy == 'most_severe':
+            return (severity, not r.get('canonical'), i)
+        if policy == 'canonical':
+            return (not r.get('canonical'), severity, i)
+        return (not r.get('mane_select'), not r.get('canonical'), severity, i)
+
+    return [min(enumerate(usable), key=rank)[1]]
+
+
+def iter_vep_records(vep_file, verbose=False):
+    """
+    流式解析 VEP TSV 输出：表头只解析一次确定列位置，逐行提取所需字段，
+    按 Uploaded_variation 分组，每遇到一个新变异就产出 (variant_id, records)。
+    records 的格式与 parse_vep_output 返回的元素相同。
+    """
+    id_idx = type_idx = extra_idx = None
+    current_id = None
+    group = []
 
     with open(vep_file) as f:
         for line in f:
             if line.startswith("#"):
                 if line.startswith("#Uploaded_variation"):
-                    headers = line.lstrip("#").strip().split("\t")
+                    headers = line.lstrip("#").rstrip("\n").split("\t")
                     if verbose:
                         print("[DEBUG] VEP 文件头字段:", headers)
-
-                    for field in ["Uploaded_variation", "Feature_type", "Extra"]:
-                        try:
-                            idx_map[field] = headers.index(field)
-                        except ValueError:
-                            idx_map[field] = None
-                    if verbose:
-                        print(f"[DEBUG] 字段索引映射: {idx_map}")
-                continue
-
-            if not headers:
+                    id_idx = headers.index("Uploaded_variation")
+                    type_idx = headers.index("Feature_type") if "Feature_type" in headers else None
+                    extra_idx = headers.index("Extra") if "Extra" in headers else None
                 continue
 
-            fields = line.strip().split("\t")
-            if len(fields) < 1:
+            if id_idx is None:
                 continue
 
-            def get_field(name):
-                idx = idx_map.get(name)
-                if idx is not None and idx < len(fields):
-                    return fields[idx]
-                return None
+            fields = line.rstrip("\n").split("\t")
+            n = len(fields)
+            variant_id = fields[id_idx] if id_idx < n else None
 
-            variant_id = get_field("Uploaded_variation")
-            feature_type = get_field("Feature_type")
-            extra = get_field("Extra")
+            if variant_id != current_id:
+                if group:
+                    yield current_id, group
+                current_id, group = variant_id, []
 
-            if feature_type != "Transcript":
+            if type_idx is None or type_idx >= n or fields[type_idx] != "Transcript":
                 continue
 
-            protein_id = None
-            hgvs_p = None
-
-            if extra:
-                extra_dict = dict()
-                for kv in extra.split(";"):
-                    if '=' in kv:
-                        k, v = kv.split("=", 1)
-                        extra_dict[k] = v  
-
-                # 直接用原始大小写键名访问
-                protein_id = extra_dict.get("SWISSPROT") or extra_dict.get("UniProtKB_ID")
-                hgvs_p = extra_dict.get("HGVSp")
-                if not protein_id:
-                    if verbose:
-                        print(f"[WARNING] 变异 {variant_id} 缺少 protein_id，标记为无法处理")
-                    variants.append({
-                        "id": variant_id,
-                        "protein_id": None,
-                        "hgvs_p": hgvs_p
-                    })
-                    continue
+            extra = fields[extra_idx] if extra_idx is not None and extra_idx < n else None
+            if not extra:
+                continue
 
-            if verbose:
-                print(f"[DEBUG] variant_id={variant_id}, protein_id={protein_id}, hgvs_p={hgvs_p}")
+            extra_fields = _extract_extra(extra)
+            protein_id = extra_fields["SWISSPROT"] or extra_fields["UniProtKB_ID"]
+            hgvs_p = extra_fields["HGVSp"]
+            if not protein_id:
+                if verbose:
+                    print(f"[WARNING] 变异 {variant_id} 缺少 protein_id，标记为无法处理")
+                group.append({"id": variant_id, "protein_id": None, "hgvs_p": hgvs_p})
+                continue
 
             if hgvs_p and ":" in hgvs_p:
                 hgvs_p = hgvs_p.split(":", 1)[1]
 
-            if protein_id and hgvs_p and hgvs_p.startswith("p."):
-                variants.append({
+            if hgvs_p and hgvs_p.startswith("p."):
+                group.append({
                     "id": variant_id,
                     "protein_id": protein_id,
-                    "hgvs_p": hgvs_p
+                    "hgvs_p": hgvs_p,
+                    "canonical": extra_fields["CANONICAL"] == "YES",
+                    "mane_select": extra_fields["MANE_SELECT"],
+                    "impact": extra_fields["IMPACT"],
                 })
 
+    if group:
+        yield current_id, group
+
+
+def parse_vep_output(vep_file, verbose=False):
+    variants = []
+    for _, records in iter_vep_records(vep_file, verbose=verbose):
+        variants.extend(records)
+
     print(f"[DEBUG] VEP注释解析完成，变异数: {len(variants)}")
     if variants:
         print("[DEBUG] 示例变异:", variants[0])
@@ -141,41 +282,70 @@ def parse_vep_output(vep_file, verbose=False):
 # ----------------------------------------------------------
 # 以下为 UniProt 相关函数
 # ----------------------------------------------------------
-CACHE_FILE = "data/cache/uniprot_seq_cache.json"
-
-# 加载缓存
-if os.path.exists(CACHE_FILE):
-    with open(CACHE_FILE, "r") as f:
-        UNIPROT_CACHE = json.load(f)
-else:
-    UNIPROT_CACHE = {}
-
-def save_cache():
-    with open(CACHE_FILE, "w") as f:
-        json.dump(UNIPROT_CACHE, f)
+# 本地序列库未命中时是否允许访问 rest.uniprot.org（生产环境无外网，默认关闭）
+UNIPROT_ALLOW_HTTP = os.environ.get("UNIPROT_ALLOW_HTTP", "0") == "1"
+# 预取蛋白序列的并发线程数（所有任务共享）
+UNIPROT_PREFETCH_WORKERS = 8
+
+_http_local = threading.local()
+_prefetch_executor = None
+_prefetch_inflight = {}       # accession → Future，跨任务去重正在进行的请求
+_prefetch_lock = threading.Lock()
+
+def _http_session():
+    """每个线程复用一个 requests.Session，保持 HTTP 连接"""
+    session = getattr(_http_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers["User-Agent"] = "Bio2502Project/1.0"
+        _http_local.session = session
+    return session
+
+def _local_uniprot_seq(uniprot_id):
+    """从本地 UniProt 序列库查询；isoform-1 即规范序列，未单独收录时按主登录号查询"""
+    store = get_uniprot_store()
+    if store is None:
+        return None
+    seq = store.get(uniprot_id)
+    if seq is None and uniprot_id.endswith("-1"):
+        seq = store.get(uniprot_id[:-2])
+    return seq
 
-def get_uniprot_seq(uniprot_id, retries=1, timeout=3):
+def get_uniprot_seq(uniprot_id, retries=1, timeout=3, allow_http=None):
     """
-    从 UniProt 获取蛋白质序列（FASTA格式），返回纯序列字符串。
+    获取蛋白质序列，返回纯序列字符串。
+    依次查询序列缓存、本地 UniProt 序列库；
+    仅在 allow_http（默认取 UNIPROT_ALLOW_HTTP）开启时才请求 UniProt 接口。
     """
-    # 去除 isoform 后缀
+    # 去除版本后缀
     uniprot_id = uniprot_id.split('.')[0]
     
     # 尝试从缓存中获取
-    if uniprot_id in UNIPROT_CACHE:
-        return UNIPROT_CACHE[uniprot_id]
+    cache = get_uniprot_cache()
+    seq = cache.get(uniprot_id)
+    if seq:
+        return seq
+
+    seq = _local_uniprot_seq(uniprot_id)
+    if seq:
+        return seq
+
+    if allow_http is None:
+        allow_http = UNIPROT_ALLOW_HTTP
+    if not allow_http:
+        print(f"[WARNING] 本地 UniProt 序列库未收录且未开启在线查询：{uniprot_id}")
+        return None
     
     url = f"https://rest.uniprot.org/uniprotkb/{uniprot_id}.fasta"
-    headers = {"User-Agent": "Bio2502Project/1.0"}
+    session = _http_session()
 
     for attempt in range(retries + 1): 
         try:
-            response = requests.get(url, timeout=timeout, headers=headers)
+            response = session.get(url, timeout=timeout)
             if response.status_code == 200:
                 lines = response.text.splitlines()
                 seq = ''.join([line.strip() for line in lines if not line.startswith('>')])
-                UNIPROT_CACHE[uniprot_id] = seq
-                save_cache()
+                cache.put(uniprot_id, seq)
                 return seq
             elif 400 <= response.status_code < 500:
                 print(f"[ERROR] UniProt请求失败（客户端错误 {response.status_code}）：{uniprot_id}")
@@ -188,6 +358,49 @@ def get_uniprot_seq(uniprot_id, retries=1, timeout=3):
 
     print(f"[ERROR] 获取 UniProt 序列失败：{uniprot_id}")
     return None
+
+def _get_prefetch_executor():
+    global _prefetch_executor
+    if _prefetch_executor is None:
+        _prefetch_executor = ThreadPoolExecutor(
+            max_workers=UNIPROT_PREFETCH_WORKERS, thread_name_prefix="uniprot-prefetch")
+    return _prefetch_executor
+
+def _release_inflight(accession, future):
+    with _prefetch_lock:
+        if _prefetch_inflight.get(accession) is future:
+            del _prefetch_inflight[accession]
+
+def prefetch_uniprot_seqs(accessions):
+    """
+    并发获取一组蛋白序列，返回 {accession: seq}（获取失败为 None）。
+    同一任务内的重复登录号只请求一次；其他任务正在请求的登录号直接等待其结果。
+    """
+    futures = {}
+    submitted = []
+    with _prefetch_lock:
+        executor = _get_prefetch_executor()
+        for accession in dict.fromkeys(a for a in accessions if a):
+            future = _prefetch_inflight.get(accession)
+            if future is None:
+                future = executor.submit(get_uniprot_seq, accession)
+                _prefetch_inflight[accession] = future
+                submitted.append((accession, future))
+            futures[accession] = future
+
+    # 回调须在释放锁后注册：已完成的 future 会在当前线程内立即执行回调，
+    # 而 _release_inflight 需要再次获取 _prefetch_lock
+    for accession, future in submitted:
+        future.add_done_callback(lambda f, a=accession: _release_inflight(a, f))
+
+    seqs = {}
+    for accession, future in futures.items():
+        try:
+            seqs[accession] = future.result()
+        except Exception as e:
+            print(f"[WARNING] 预取 UniProt 序列失败: {accession}: {e}")
+            seqs[accession] = None
+    return seqs
 # ---------------------------------------------------------------
 
 
@@ -1,9 +1,19 @@
+import copy
+import hashlib
 import torch
 import torch.nn.functional as F
 import joblib
+import numpy as np
 import os
+import threading
+import time
 from predict.model.model import VariantClassifier
-from predict.model.dataset import extract_region, dna_to_tensor
+from predict.model.dataset import (extract_region, extract_span, window_start, encode_sequences,
+                                   dna_to_tensor, dna_batch_to_tensor)
+from predict.model.genome import N_BYTE
+from predict.model import export, quantize
+from app.utils.prediction_cache import get_prediction_cache, normalize_key
+from app.utils.score_table import get_score_table
 
 # 加载模型和编码器
 MODEL_PATH = 'predict/model/best_model.pth'
@@ -16,6 +26,23 @@ EMBED_DIM = 16
 GENE_EMBED_DIM = 8
 SEQ_LEN = 1000
 
+# 批量推理时每个 mini-batch 的变异数
+PREDICT_BATCH_SIZE = 64
+
+# 推理后端：'eager'（默认）/ 'torchscript' / 'onnxruntime'（需安装 onnxruntime）
+INFERENCE_BACKENDS = ('eager', 'torchscript', 'onnxruntime')
+_INFERENCE_CONFIG = {
+    'backend': os.environ.get('PREDICT_BACKEND', 'eager'),
+    'threads': int(os.environ.get('PREDICT_THREADS', '0')),  # intra-op 线程数，0 表示使用默认值
+    'quantize': os.environ.get('PREDICT_QUANTIZE', 'none'),   # 'none' / 'dynamic' / 'static'（仅 CPU）
+    # 相邻变异共享 conv1 计算（仅 eager 浮点模型）
+    'conv_reuse': os.environ.get('PREDICT_CONV_REUSE', '0') == '1',
+}
+
+# 共享 conv1 时单个合并区域的最大长度（碱基），以及窗口两端需要单独修正的列数（conv1 padding）
+CONV_REUSE_MAX_REGION = 16384
+CONV1_EDGE = 3
+
 CLNSIG_SCORE = {
     'Benign': 0.0,
     'Likely_benign': 0.1,
@@ -47,30 +74,298 @@ def load_model():
     return model, gene_encoder
 
 
+def configure_inference(backend=None, threads=None, quantize_mode=None, conv_reuse=None):
+    """
+    设置推理后端、intra-op 线程数、量化模式以及是否在相邻变异间共享 conv1；
+    后端或量化模式变化后下一次 get_model() 会重新加载。
+    """
+    if conv_reuse is not None:
+        _INFERENCE_CONFIG['conv_reuse'] = bool(conv_reuse)
+    if backend is not None:
+        if backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"未知的推理后端: {backend}")
+        _INFERENCE_CONFIG['backend'] = backend
+    if quantize_mode is not None:
+        if quantize_mode not in quantize.QUANTIZE_MODES:
+            raise ValueError(f"未知的量化模式: {quantize_mode}")
+        _INFERENCE_CONFIG['quantize'] = quantize_mode
+    if threads is not None:
+        _INFERENCE_CONFIG['threads'] = int(threads)
+    if _INFERENCE_CONFIG['threads'] > 0:
+        torch.set_num_threads(_INFERENCE_CONFIG['threads'])
+
+
+configure_inference()
+
+
+class TorchScriptPredictor:
+    """合并 BatchNorm 并 freeze 后的 TorchScript 模型，调用方式与 VariantClassifier 相同"""
+
+    def __init__(self, path, use_gene):
+        self.module = torch.jit.load(path, map_location=DEVICE)
+        self.use_gene = use_gene
+
+    def __call__(self, seq, gene=None, variant_mask=None):
+        if gene is None:
+            gene = torch.zeros(seq.size(0), dtype=torch.long, device=seq.device)
+        return self.module(seq, gene, variant_mask)
+
+
+class OnnxPredictor:
+    """onnxruntime CPU 推理会话，输入输出均为 torch 张量"""
+
+    def __init__(self, path, use_gene, threads=0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.use_gene = use_gene
+
+    def __call__(self, seq, gene=None, variant_mask=None):
+        if gene is None:
+            gene = torch.zeros(seq.size(0), dtype=torch.long)
+        feeds = {
+            'seq': seq.cpu().numpy().astype('int64'),
+            'gene': gene.cpu().numpy().astype('int64'),
+            'variant_mask': variant_mask.cpu().numpy().astype('float32'),
+        }
+        output = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+        return torch.from_numpy(output).to(seq.device)
+
+
+def _build_predictor(model, backend):
+    """
+    按后端包装 eager 模型，导出产物缺失或过期时自动导出。
+    与 eager 输出做一致性检查，误差超过 PARITY_ATOL 或加载失败时退回 eager。
+    返回 (predictor, 实际后端, 最大误差)。
+    """
+    if backend == 'eager':
+        return model, 'eager', 0.0
+
+    try:
+        cpu_model = copy.deepcopy(model).cpu()
+        if backend == 'torchscript':
+            path = export.artifact_path(MODEL_PATH, export.TORCHSCRIPT_SUFFIX)
+            if export.is_stale(path, MODEL_PATH):
+                export.export_torchscript(cpu_model, path, seq_len=SEQ_LEN)
+            predictor = TorchScriptPredictor(path, model.use_gene)
+        else:
+            path = export.artifact_path(MODEL_PATH, export.ONNX_SUFFIX)
+            if export.is_stale(path, MODEL_PATH):
+                export.export_onnx(cpu_model, path, seq_len=SEQ_LEN)
+            predictor = OnnxPredictor(path, model.use_gene, _INFERENCE_CONFIG['threads'])
+
+        inputs = tuple(t.to(DEVICE) for t in export.example_inputs(model, seq_len=SEQ_LEN, vocab_size=VOCAB_SIZE))
+        diff = export.max_abs_diff(model, predictor, inputs)
+    except Exception as e:
+        print(f"[WARNING] 推理后端 {backend} 不可用，改用 eager: {e}")
+        return model, 'eager', 0.0
+
+    if diff > export.PARITY_ATOL:
+        print(f"[WARNING] 推理后端 {backend} 与 eager 输出不一致 (最大误差 {diff:.2e})，改用 eager")
+        return model, 'eager', diff
+    print(f"[INFO] 使用推理后端 {backend}，与 eager 最大误差 {diff:.2e}")
+    return predictor, backend, diff
+
+
+def _build_quantized(model, gene_encoder, mode):
+    """
+    生成 int8 量化模型，并在 brca_clinvar.db 抽样的校准集上与浮点模型比较。
+    校准集不可用时静态量化退回动态量化；返回 (模型, 实际模式, 报告)，失败时模型为 None。
+    """
+    if DEVICE.type != 'cpu':
+        print("[WARNING] 量化推理仅支持 CPU，忽略量化设置")
+        return None, 'none', None
+
+    calibration = None
+    try:
+        calibration = quantize.load_calibration_set(gene_encoder)
+    except Exception as e:
+        print(f"[WARNING] 量化校准集加载失败: {e}")
+        if mode == 'static':
+            print("[WARNING] 静态量化需要校准集，改用动态量化")
+            mode = 'dynamic'
+
+    try:
+        quantized = quantize.quantize_model(model, mode, calibration)
+    except Exception as e:
+        print(f"[WARNING] 模型量化失败，使用浮点模型: {e}")
+        return None, 'none', None
+
+    report = None
+    if calibration is not None:
+        report = quantize.quantization_report(model, quantized, calibration, _score_to_label)
+        print(f"[INFO] {mode} 量化: MSE 变化 {report['mse_delta']:+.4f}, "
+              f"标签一致率 {report['label_agreement']:.2%}, "
+              f"模型 {report['size_float_bytes'] / 1024:.0f} KB → {report['size_quantized_bytes'] / 1024:.0f} KB, "
+              f"每批耗时 {report['batch_latency_float_ms']:.1f} ms → {report['batch_latency_quantized_ms']:.1f} ms")
+    return quantized, mode, report
+
+
+# ----------------------------------------------------------
+# 进程内共享的模型注册表：所有任务线程复用同一份 eval 模式模型
+# ----------------------------------------------------------
+_MODEL_LOCK = threading.Lock()
+_MODEL_REGISTRY = {
+    'model': None,
+    'gene_encoder': None,
+    'mtime': None,
+    'load_time': None,
+    'memory_bytes': None,
+    'requested': None,
+    'backend': None,
+    'parity_max_diff': None,
+    'quantize': None,
+    'quantization_report': None,
+    'checksum': None,
+    'cache_key': None,
+}
+
+
+def _file_checksum(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _model_memory_bytes(model):
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def get_model():
+    """
+    返回共享的 (model, gene_encoder)。首次调用时加载，
+    best_model.pth 的 mtime、推理后端或量化模式变化时自动重新加载。线程安全。
+    返回的 model 可能是 TorchScript / onnxruntime 包装或 int8 量化模型，调用方式与 eager 模型相同。
+    """
+    mtime = os.path.getmtime(MODEL_PATH)
+    requested = (_INFERENCE_CONFIG['backend'], _INFERENCE_CONFIG['quantize'])
+    registry = _MODEL_REGISTRY
+    if registry['model'] is not None and registry['mtime'] == mtime and registry['requested'] == requested:
+        return registry['model'], registry['gene_encoder']
+
+    with _MODEL_LOCK:
+        # 双重检查：其他线程可能已经完成加载
+        if registry['model'] is None or registry['mtime'] != mtime or registry['requested'] != requested:
+            backend, quantize_mode = requested
+            start = time.perf_counter()
+            model, gene_encoder = load_model()
+
+            quantized, active_quantize, report = None, 'none', None
+            if quantize_mode != 'none':
+                quantized, active_quantize, report = _build_quantized(model, gene_encoder, quantize_mode)
+
+            if quantized is not None:
+                if backend != 'eager':
+                    print(f"[WARNING] 量化模型仅支持 eager 后端，忽略推理后端 {backend}")
+                predictor, active_backend, diff = quantized, 'eager', None
+                memory_bytes = quantize.model_size_bytes(quantized)
+            else:
+                predictor, active_backend, diff = _build_predictor(model, backend)
+                memory_bytes = _model_memory_bytes(model)
+
+            checksum = _file_checksum(MODEL_PATH)
+            registry.update({
+                'model': predictor,
+                'gene_encoder': gene_encoder,
+                'mtime': mtime,
+                'load_time': time.perf_counter() - start,
+                'memory_bytes': memory_bytes,
+                'requested': requested,
+                'backend': active_backend,
+                'parity_max_diff': diff,
+                'quantize': active_quantize,
+                'quantization_report': report,
+                'checksum': checksum,
+                # 预测缓存键：权重内容 + 实际使用的后端和量化模式
+                'cache_key': f"{checksum}:{active_backend}:{active_quantize}",
+            })
+            print(f"[INFO] 模型已加载: 耗时 {registry['load_time']:.2f}s, "
+                  f"占用内存 {registry['memory_bytes'] / 1024 / 1024:.2f} MB")
+        return registry['model'], registry['gene_encoder']
+
+
+def get_model_info():
+    """返回共享模型的加载状态、耗时（秒）和参数内存占用（字节）"""
+    registry = _MODEL_REGISTRY
+    return {
+        'loaded': registry['model'] is not None,
+        'model_path': MODEL_PATH,
+        'mtime': registry['mtime'],
+        'load_time': registry['load_time'],
+        'memory_bytes': registry['memory_bytes'],
+        'device': str(DEVICE),
+        'backend': registry['backend'],
+        'requested_backend': registry['requested'][0] if registry['requested'] else None,
+        'parity_max_diff': registry['parity_max_diff'],
+        'quantize': registry['quantize'],
+        'quantization_report': registry['quantization_report'],
+        'checksum': registry['checksum'],
+        'cache_key': registry['cache_key'],
+        'intra_op_threads': torch.get_num_threads(),
+    }
+
+
+def _encode_gene(gene_encoder, gene):
+    if gene_encoder and isinstance(gene, str) and gene in gene_encoder.classes_:
+        return int(gene_encoder.transform([gene])[0])
+    return 0  # 未知基因编码为 0
+
+
+def _score_to_label(score):
+    # 映射到临床标签
+    return min(CLNSIG_SCORE.items(), key=lambda x: abs(score - x[1]))[0]
+
+
+def _build_mask(batch_size):
+    # 构建 variant mask（只有变异位点为1，其余为0），变异位于序列中心
+    mask = torch.zeros(1, SEQ_LEN, dtype=torch.float32)
+    mask[0, SEQ_LEN // 2] = 1.0
+    return mask.expand(batch_size, -1).to(DEVICE)
+
+
+def _n_ratio(seq):
+    # seq 为 extract_region 返回的 uint8 数组
+    return float(np.count_nonzero(seq == N_BYTE)) / len(seq) if len(seq) else 1.0
+
+
 def predict_variant(model, gene_encoder, variant):
     chrom = variant['chrom']
     pos = variant['pos']
+
+    key = normalize_key(chrom, pos, variant.get('gene'))
+    table = _score_table_for(model)
+    if table is not None:
+        score = _table_lookup(table, model, gene_encoder, [key]).get(key)
+        if score is not None:
+            return score, _score_to_label(score)
+
+    cache = _prediction_cache_for(model)
+    if cache is not None:
+        cached = cache.get_many([key])
+        if key in cached:
+            return cached[key], _score_to_label(cached[key])
+
     seq = extract_region(chrom, pos, window=SEQ_LEN)
     
-    if seq.count('N') / len(seq) > 0.5:
-        print(f"[DEBUG] 变异 {variant['id']}：序列 N 比例过高 ({seq.count('N') / len(seq):.2f})")
+    n_ratio = _n_ratio(seq)
+    if n_ratio > 0.5:
+        print(f"[DEBUG] 变异 {variant['id']}：序列 N 比例过高 ({n_ratio:.2f})")
 
     # 转换 DNA 序列为张量 (1, L)
     seq_tensor = dna_to_tensor(seq).unsqueeze(0).to(DEVICE)
-
-    # 构建 variant mask（只有变异位点为1，其余为0）
-    mask = torch.zeros(SEQ_LEN, dtype=torch.float32)
-    center_pos = SEQ_LEN // 2  # 变异位于序列中心
-    mask[center_pos] = 1.0
-    mask_tensor = mask.unsqueeze(0).to(DEVICE)  # (1, L)
+    mask_tensor = _build_mask(1)  # (1, L)
 
     # 编码 gene
     gene = variant.get('gene')
     if model.use_gene:
-        if gene_encoder and isinstance(gene, str) and gene in gene_encoder.classes_:
-            gene_idx = gene_encoder.transform([gene])[0]
-        else:
-            gene_idx = 0  # 未知基因编码为 0
+        gene_idx = _encode_gene(gene_encoder, gene)
         gene_tensor = torch.tensor([gene_idx], dtype=torch.long).to(DEVICE)
         output = model(seq_tensor, gene_tensor, mask_tensor)
     else:
@@ -78,13 +373,198 @@ def predict_variant(model, gene_encoder, variant):
 
     output.clamp_(0, 1)
     score = output.item()
+    if cache is not None:
+        cache.put_many({key: score})
 
-    # 映射到临床标签
-    closest_label = min(CLNSIG_SCORE.items(), key=lambda x: abs(score - x[1]))[0]
+    closest_label = _score_to_label(score)
     # print(f"[DEBUG] 变异 {variant['id']} 预测得分: {score:.4f} 预测标签: {closest_label}")
     return score, closest_label
 
 
+def _prediction_cache_for(model):
+    """只有共享注册表中的模型才使用预测缓存，缓存键包含权重校验和与推理配置"""
+    registry = _MODEL_REGISTRY
+    if model is None or model is not registry['model'] or not registry['cache_key']:
+        return None
+    return get_prediction_cache(registry['cache_key'])
+
+
+def _score_table_for(model):
+    """只有共享注册表中的模型才查询预计算得分表，表的 model_key 需与当前权重和推理配置一致"""
+    registry = _MODEL_REGISTRY
+    if model is None or model is not registry['model'] or not registry['cache_key']:
+        return None
+    return get_score_table(registry['cache_key'])
+
+
+def _table_lookup(table, model, gene_encoder, keys):
+    """
+    得分表按 (chrom, pos) 存放不带基因时的得分，只有基因编码与之相同的键
+    （或模型不使用基因）才能查表，返回 {key: score}。
+    """
+    found = {}
+    for key in keys:
+        chrom, pos, gene = key
+        if model.use_gene and _encode_gene(gene_encoder, gene or None) != table.gene_index:
+            continue
+        score = table.lookup(chrom, pos)
+        if score is not None:
+            found[key] = score
+    return found
+
+
+def _cluster_windows(infos):
+    """
+    按染色体和窗口起点排序，把窗口相互重叠、总长度不超过 CONV_REUSE_MAX_REGION 的变异归为一组，
+    返回 [(chrom, region_start, [(info 下标, 窗口起点), ...])]。
+    """
+    windows = sorted(
+        (str(info['chrom']), window_start(info['pos'], SEQ_LEN), i) for i, info in enumerate(infos))
+    clusters = []
+    for chrom, start, i in windows:
+        if clusters:
+            c_chrom, c_start, members = clusters[-1]
+            last_start = members[-1][1]
+            if (c_chrom == chrom and start < last_start + SEQ_LEN
+                    and start + SEQ_LEN - c_start <= CONV_REUSE_MAX_REGION):
+                members.append((i, start))
+                continue
+        clusters.append((chrom, start, [(i, start)]))
+    return clusters
+
+
+def _run_batch_shared(model, gene_encoder, infos):
+    """
+    对相互重叠的变异窗口，在合并区域上只计算一次 embedding + conv1/bn1/relu，
+    再切出每个变异的 (32, SEQ_LEN) 特征；窗口两端 CONV1_EDGE 列受 zero padding 影响，
+    用窗口自身的首尾碱基单独重算。之后的 pool/conv2/全连接层按变异批量计算。
+    无法取得完整区域（染色体缺失或到达末端）的组退回逐窗口计算。
+    """
+    features = [None] * len(infos)
+    fallback = []
+    edge_len = 2 * CONV1_EDGE
+
+    with torch.inference_mode():
+        for chrom, region_start, members in _cluster_windows(infos):
+            region_end = members[-1][1] + SEQ_LEN - 1
+            region = extract_span(chrom, region_start, region_end)
+            if region is None or len(region) != region_end - region_start + 1:
+                fallback.extend(i for i, _ in members)
+                continue
+
+            tokens = torch.from_numpy(encode_sequences([region], len(region))).long().to(DEVICE)
+            shared = model.conv1_block(tokens)[0]  # (32, R)
+
+            offsets = [start - region_start for _, start in members]
+            edges = torch.cat([
+                torch.stack([tokens[0, o:o + edge_len] for o in offsets]),
+                torch.stack([tokens[0, o + SEQ_LEN - edge_len:o + SEQ_LEN] for o in offsets]),
+            ])
+            edge_out = model.conv1_block(edges)  # (2n, 32, edge_len)
+            n = len(members)
+            for k, ((i, _), o) in enumerate(zip(members, offsets)):
+                x = shared[:, o:o + SEQ_LEN].clone()
+                x[:, :CONV1_EDGE] = edge_out[k, :, :CONV1_EDGE]
+                x[:, -CONV1_EDGE:] = edge_out[n + k, :, CONV1_EDGE:]
+                features[i] = x
+
+        if fallback:
+            seqs = [extract_region(infos[i]['chrom'], infos[i]['pos'], window=SEQ_LEN) for i in fallback]
+            tokens = dna_batch_to_tensor(seqs, SEQ_LEN).to(DEVICE)
+            for i, x in zip(fallback, model.conv1_block(tokens)):
+                features[i] = x
+
+        x = torch.stack(features)
+        mask_tensor = _build_mask(len(infos))
+        if model.use_gene:
+            gene_list = [_encode_gene(gene_encoder, info.get('gene')) for info in infos]
+            gene_tensor = torch.tensor(gene_list, dtype=torch.long).to(DEVICE)
+            output = model.forward_from_conv1(x, gene_tensor, mask_tensor)
+        else:
+            output = model.forward_from_conv1(x, variant_mask=mask_tensor)
+        output = output.clamp(0, 1)
+    return output.cpu().tolist()
+
+
+def _run_batch(model, gene_encoder, infos):
+    """对一组 variant_info 做一次前向传播，返回得分列表"""
+    if _INFERENCE_CONFIG['conv_reuse'] and isinstance(model, VariantClassifier):
+        return _run_batch_shared(model, gene_encoder, infos)
+
+    seq_list = []
+    gene_list = []
+    for info in infos:
+        seq = extract_region(info['chrom'], info['pos'], window=SEQ_LEN)
+        n_ratio = _n_ratio(seq)
+        if n_ratio > 0.5:
+            print(f"[DEBUG] 变异 {info.get('id')}：序列 N 比例过高 ({n_ratio:.2f})")
+        seq_list.append(seq)
+        gene_list.append(_encode_gene(gene_encoder, info.get('gene')))
+
+    seq_tensor = dna_batch_to_tensor(seq_list, SEQ_LEN).to(DEVICE)  # (B, L)
+    mask_tensor = _build_mask(len(infos))                          # (B, L)
+
+    with torch.inference_mode():
+        if model.use_gene:
+            gene_tensor = torch.tensor(gene_list, dtype=torch.long).to(DEVICE)
+            output = model(seq_tensor, gene_tensor, mask_tensor)
+        else:
+            output = model(seq_tensor, variant_mask=mask_tensor)
+        output = output.clamp(0, 1)
+    return output.cpu().tolist()
+
+
+def predict_variants(model, gene_encoder, variants, batch_size=PREDICT_BATCH_SIZE, use_cache=True):
+    """
+    批量预测：先查询离线预计算得分表（按 (chrom, pos)）和预测缓存（按 (chrom, pos, gene)），
+    都未命中的位点去重后按 batch_size 切分为 mini-batch，每个批次只做一次前向传播。
+    预测结果写回每个 v['predict_result']，返回与有 variant_info 的变异一一对应的得分列表。
+    """
+    items = [v for v in variants if v.get('variant_info')]
+    keys = [normalize_key(v['variant_info']['chrom'], v['variant_info']['pos'], v['variant_info'].get('gene'))
+            for v in items]
+
+    table = _score_table_for(model) if use_cache else None
+    results = _table_lookup(table, model, gene_encoder, keys) if table is not None else {}
+    from_table = len(results)
+
+    cache = _prediction_cache_for(model) if use_cache else None
+    if cache is not None:
+        results.update(cache.get_many([key for key in keys if key not in results]))
+
+    # 同一位点只预测一次
+    pending = {}
+    for v, key in zip(items, keys):
+        if key not in results and key not in pending:
+            pending[key] = v['variant_info']
+    pending_keys = list(pending)
+    if _INFERENCE_CONFIG['conv_reuse']:
+        # 相邻位点放在同一批次，便于共享 conv1
+        pending_keys.sort()
+
+    computed = {}
+    for start in range(0, len(pending_keys), batch_size):
+        chunk = pending_keys[start:start + batch_size]
+        for key, score in zip(chunk, _run_batch(model, gene_encoder, [pending[k] for k in chunk])):
+            computed[key] = score
+    if cache is not None:
+        cache.put_many(computed)
+        print(f"[DEBUG] 得分表命中 {from_table} 个位点，预测缓存命中 {len(results) - from_table} 个，"
+              f"新预测 {len(computed)} 个")
+    results.update(computed)
+
+    scores = []
+    for v, key in zip(items, keys):
+        score = results[key]
+        v['predict_result'] = {
+            'predict_score': score,
+            'clnsig_pred': _score_to_label(score),
+        }
+        scores.append(score)
+
+    return scores
+
+
 def compute_alt_dosage(ref, alt, genotype):
     if not genotype or genotype == "NA":
         return 0
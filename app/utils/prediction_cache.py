@@ -0,0 +1,158 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+PREDICTION_CACHE_DB = "data/cache/prediction_cache.db"
+# 是否将预测结果持久化到 SQLite；关闭时只使用进程内 LRU
+PREDICTION_CACHE_PERSIST = os.environ.get("PREDICTION_CACHE_PERSIST", "1") == "1"
+LRU_SIZE = 100000
+QUERY_CHUNK_SIZE = 400
+
+
+def normalize_key(chrom, pos, gene):
+    """(chrom, pos, gene) → 缓存键，染色体去掉 chr 前缀"""
+    chrom = str(chrom)
+    if chrom.lower().startswith("chr"):
+        chrom = chrom[3:]
+    return chrom, int(pos), str(gene) if gene is not None else ""
+
+
+class PredictionCache:
+    """
+    模型预测结果缓存：窗口取自参考基因组且不编码 alt，
+    同一模型对相同 (chrom, pos, gene) 的预测结果固定不变。
+    进程内 LRU 在前，可选的 SQLite (WAL) 表在后；
+    model_key（权重校验和 + 推理配置）变化时清空旧结果。
+    """
+
+    def __init__(self, model_key, db_path=PREDICTION_CACHE_DB, persistent=PREDICTION_CACHE_PERSIST,
+                 lru_size=LRU_SIZE):
+        self.model_key = model_key
+        self.db_path = db_path
+        self.persistent = persistent
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._hits = 0
+        self._misses = 0
+
+        if self.persistent:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            conn = self._conn()
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS predictions (
+                        model_key TEXT,
+                        chrom TEXT,
+                        pos INTEGER,
+                        gene TEXT,
+                        score REAL,
+                        created_at REAL,
+                        PRIMARY KEY (model_key, chrom, pos, gene)
+                    )
+                """)
+                removed = conn.execute(
+                    "DELETE FROM predictions WHERE model_key != ?", (model_key,)).rowcount
+            if removed:
+                print(f"[INFO] 模型已更新，清理旧的预测缓存 {removed} 条")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, items):
+        with self._lock:
+            for key, score in items:
+                self._lru[key] = score
+                self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def get_many(self, keys):
+        """keys 为 normalize_key 的结果，返回命中的 {key: score}"""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            for key in keys:
+                score = self._lru.get(key)
+                if score is not None:
+                    self._lru.move_to_end(key)
+                    found[key] = score
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.persistent:
+            conn = self._conn()
+            loaded = []
+            for i in range(0, len(missing), QUERY_CHUNK_SIZE):
+                chunk = missing[i:i + QUERY_CHUNK_SIZE]
+                values = ",".join("(?, ?, ?)" for _ in chunk)
+                params = [self.model_key] + [v for key in chunk for v in key]
+                for chrom, pos, gene, score in conn.execute(
+                        f"SELECT chrom, pos, gene, score FROM predictions "
+                        f"WHERE model_key = ? AND (chrom, pos, gene) IN (VALUES {values})", params):
+                    loaded.append(((chrom, pos, gene), score))
+            found.update(loaded)
+            self._remember(loaded)
+
+        with self._lock:
+            self._hits += len(found)
+            self._misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, entries):
+        """entries: {key: score}"""
+        if not entries:
+            return
+        self._remember(entries.items())
+        if self.persistent:
+            now = time.time()
+            conn = self._conn()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO predictions (model_key, chrom, pos, gene, score, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(self.model_key, *key, score, now) for key, score in entries.items()]
+                )
+
+    def get_stats(self):
+        with self._lock:
+            hits, misses, lru_entries = self._hits, self._misses, len(self._lru)
+        total = hits + misses
+        stats = {
+            'model_key': self.model_key,
+            'persistent': self.persistent,
+            'lru_entries': lru_entries,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+        }
+        if self.persistent:
+            stats['entries'] = self._conn().execute(
+                "SELECT COUNT(*) FROM predictions WHERE model_key = ?", (self.model_key,)).fetchone()[0]
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_prediction_cache(model_key):
+    """返回与 model_key 对应的全局缓存；模型变化时重建（并清理持久化的旧结果）"""
+    global _cache
+    with _cache_lock:
+        if _cache is None or _cache.model_key != model_key:
+            _cache = PredictionCache(model_key)
+        return _cache
+
+
+def get_cache_stats():
+    cache = _cache
+    return cache.get_stats() if cache is not None else {'model_key': None}
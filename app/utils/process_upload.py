@@ -1,50 +1,161 @@
 from cyvcf2 import VCF
 import app.utils.clinvar_query as clinvar_query
 import tempfile
-from app.utils.gene_to_protein import run_vep, parse_vep_output, get_uniprot_seq, parse_hgvs_protein, mutate_sequence
+from app.utils.gene_to_protein import iter_vep_records, select_transcript, TRANSCRIPT_POLICY, prefetch_uniprot_seqs, parse_hgvs_protein, mutate_sequence
 import os
 import traceback
+from app.utils.vep_server import annotate_vcf
+from app.utils.vep_cache import get_vep_cache
 
-def process_vcf(vcf_path, verbose=False):
+# 流式读取 VCF 时每个块包含的记录数
+VCF_CHUNK_SIZE = 5000
+
+
+def _compact_record(record):
+    """只保留下游需要的字段，不持有 cyvcf2 Variant 对象"""
+    var_id = record.ID if record.ID else f"{record.CHROM}:{record.POS}"
+    gt_bases = record.gt_bases
+    genotype = str(gt_bases[0]) if gt_bases is not None and len(gt_bases) else "NA"
+    return {
+        'id': var_id,
+        'chrom': record.CHROM,
+        'pos': record.POS,
+        'ref': record.REF,
+        'alt': ",".join(record.ALT),
+        'genotype': genotype
+    }
+
+
+def iter_vcf_chunks(vcf_path, chunk_size=VCF_CHUNK_SIZE):
+    """
+    逐条迭代 cyvcf2 记录，每 chunk_size 条产出一个精简字段字典列表。
+    支持未压缩和 bgzip 压缩 (.vcf.gz) 的 VCF。
+    """
+    chunk = []
+    vcf_reader = VCF(vcf_path)
+    try:
+        for record in vcf_reader:
+            chunk.append(_compact_record(record))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        vcf_reader.close()
+
+
+def _vep_output_complete(vep_output_file):
+    """VEP 正常运行时输出中一定包含 #Uploaded_variation 表头"""
+    if not os.path.exists(vep_output_file):
+        return False
+    with open(vep_output_file) as f:
+        for line in f:
+            if not line.startswith("#"):
+                break
+            if line.startswith("#Uploaded_variation"):
+                return True
+    return False
+
+
+def annotate_with_cache(variant_dict, vep_input_file, vep_output_file, progress_callback=None,
+                        policy=TRANSCRIPT_POLICY):
+    """
+    按 (assembly, chrom, pos, ref, alt, VEP 版本) 查询注释缓存，
+    只把未命中的变异写入 vep_input_file 交给 VEP，注释结果回写缓存。
+    缓存中保存全部转录本，返回前按 policy 为每个变异选出转录本，
+    返回与 parse_vep_output 格式相同的注释列表。
+    """
+    cache = get_vep_cache()
+    keys = {
+        var_id: cache.make_key(info['chrom'], info['pos'], info['ref'], info['alt'])
+        for var_id, info in variant_dict.items()
+    }
+    cached = cache.get_many(keys.values())
+
+    records_by_id = {}
+    misses = []
+    for var_id, key in keys.items():
+        if key in cached:
+            records_by_id[var_id] = [{'id': var_id, **record} for record in cached[key]]
+        else:
+            misses.append(var_id)
+    print(f"[DEBUG] VEP 注释缓存命中 {len(keys) - len(misses)} 条，需注释 {len(misses)} 条")
+
+    if misses:
+        # 未命中的变异写成精简 VCF，ID 列使用 var_id，保证 Uploaded_variation 与之对应
+        with open(vep_input_file, "w") as f:
+            f.write("##fileformat=VCFv4.2\n")
+            f.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
+            for var_id in misses:
+                info = variant_dict[var_id]
+                f.write(f"{info['chrom']}\t{info['pos']}\t{var_id}\t{info['ref']}\t{info['alt']}\t.\t.\t.\n")
+
+        print(f"[DEBUG] 调用 VEP 注释，输出文件: {vep_output_file}")
+        annotate_vcf(vep_input_file, vep_output_file, progress_callback=progress_callback)
+        print(f"[DEBUG] VEP 注释完成，文件存在: {os.path.exists(vep_output_file)}")
+
+        new_records = {var_id: [] for var_id in misses}
+        for var_id, records in iter_vep_records(vep_output_file):
+            if var_id in new_records:
+                new_records[var_id].extend(records)
+
+        # 只缓存 VEP 正常完成的结果，避免把失败的空结果写入缓存
+        if _vep_output_complete(vep_output_file):
+            cache.put_many({
+                keys[var_id]: [{k: v for k, v in r.items() if k != 'id'} for r in records]
+                for var_id, records in new_records.items()
+            })
+        records_by_id.update(new_records)
+    elif progress_callback:
+        progress_callback(1, 1)
+
+    annotated_variants = []
+    for var_id in keys:
+        annotated_variants.extend(select_transcript(records_by_id.get(var_id, []), policy))
+    print(f"[DEBUG] 转录本选择策略: {policy}")
+    return annotated_variants
+
+
+def process_vcf(vcf_path, verbose=False, progress_callback=None):
+    vep_input_file = f"{vcf_path}.vep_input.vcf"
     vep_output_file = f"{vcf_path}.tsv"
     variants = []
 
     try:
         print(f"[DEBUG] 读取 VCF 文件: {vcf_path}")
-        vcf_reader = VCF(vcf_path)
-        vcf_records = list(vcf_reader)
-        print(f"[DEBUG] 读取到 {len(vcf_records)} 条变异记录")
 
-        if not vcf_records:
+        # 流式读取 VCF，只保留精简字段，不持有 cyvcf2 Variant 对象。
+        # 注释、预测和结果仍按整个任务一次性处理，内存占用随变异数增长，
+        # 上传大小由 MAX_UPLOAD_SIZE 限制
+        variant_dict = {}
+        record_count = 0
+        for chunk in iter_vcf_chunks(vcf_path):
+            record_count += len(chunk)
+            for info in chunk:
+                variant_dict[info['id']] = info
+            if verbose:
+                print(f"[DEBUG] 已读取 {record_count} 条变异记录")
+        print(f"[DEBUG] 读取到 {record_count} 条变异记录")
+
+        if not variant_dict:
             print("[WARNING] VCF 文件中无变异记录")
             return []
 
-        # 建立 VCF 记录字典
-        variant_dict = {}
-        for record in vcf_records:
-            var_id = record.ID if record.ID else f"{record.CHROM}:{record.POS}"
-            alt = ",".join(record.ALT)
-            genotype = record.gt_bases[0] if record.gt_bases else "NA"
-            variant_dict[var_id] = {
-                'id': var_id,
-                'chrom': record.CHROM,
-                'pos': record.POS,
-                'ref': record.REF,
-                'alt': alt,
-                'genotype': genotype
-            }
-
         print(f"[DEBUG] 构建 VCF 变异字典，共 {len(variant_dict)} 条")
 
-        # Step 2: 调用 VEP
-        print(f"[DEBUG] 调用 VEP 注释，输出文件: {vep_output_file}")
-        run_vep(vcf_path, vep_output_file)
-        print(f"[DEBUG] VEP 注释完成，文件存在: {os.path.exists(vep_output_file)}")
-
-        # Step 3: 解析 VEP 输出
-        annotated_variants = parse_vep_output(vep_output_file)
+        # Step 2 & 3: 先查注释缓存，只将未命中的变异交给 VEP 并解析输出
+        annotated_variants = annotate_with_cache(
+            variant_dict, vep_input_file, vep_output_file, progress_callback=progress_callback)
         print(f"[DEBUG] 解析 VEP 注释结果，共获得 {len(annotated_variants)} 条注释")
 
+        # 先并发预取本任务涉及的全部蛋白序列，再逐条构建突变序列
+        protein_seqs = prefetch_uniprot_seqs(
+            v['protein_id'] for v in annotated_variants
+            if v.get('protein_id') and v['id'] in variant_dict
+        )
+        print(f"[DEBUG] 预取蛋白序列 {len(protein_seqs)} 条，成功 {sum(1 for s in protein_seqs.values() if s)} 条")
+
         protein_info_dict = {}
         # 检查每条是否包含蛋白信息
         for v in annotated_variants:
@@ -62,7 +173,7 @@ def process_vcf(vcf_path, verbose=False):
                     print(f"[DEBUG] 缺少 protein_id: protein_id={protein_id}")
                 continue
             else:
-                seq = get_uniprot_seq(protein_id)
+                seq = protein_seqs.get(protein_id)
                 if not seq:
                     if verbose:
                         print(f"[WARNING] 无法获取 UniProt 序列: {protein_id}")
@@ -87,6 +198,7 @@ def process_vcf(vcf_path, verbose=False):
 
             protein_info_dict[var_id] = {
                 'protein_id': protein_id,
+                'transcript_policy': TRANSCRIPT_POLICY,
                 'position': pos,
                 'ref_aa': ref_aa,
                 'alt_aa': alt_aa,
@@ -116,12 +228,13 @@ def process_vcf(vcf_path, verbose=False):
         raise RuntimeError(f"VCF处理失败: {str(e)}") from e
 
     finally:
-        if os.path.exists(vep_output_file):
-            try:
-                os.remove(vep_output_file)
-                print(f"[DEBUG] 删除临时文件: {vep_output_file}")
-            except Exception as e:
-                print(f"[WARNING] 无法删除临时文件 {vep_output_file}: {e}")
+        for tmp_file in (vep_input_file, vep_output_file):
+            if os.path.exists(tmp_file):
+                try:
+                    os.remove(tmp_file)
+                    print(f"[DEBUG] 删除临时文件: {tmp_file}")
+                except Exception as e:
+                    print(f"[WARNING] 无法删除临时文件 {tmp_file}: {e}")
 
 
 def process_rsid(rsid):
@@ -1,69 +1,134 @@
-import sqlite3
+import threading
+import numpy as np
+from app.utils import db_pool
 
-def compute_prs(variants, prs_db="data/prs/prs_brca.db", verbose=False):
+DEFAULT_PRS_DB = "data/prs/prs_brca.db"
 
-    # 0. 从变异中提取rsID
-    rsids = [v['variant_info']['id'] for v in variants if 'id' in v['variant_info']]
+_weights_lock = threading.Lock()
+_weights_cache = {}
 
-    if not rsids:
+
+class PRSWeights:
+    """
+    预加载的 PRS 权重表：rsID → 行号索引，效应等位基因和权重保存为 NumPy 数组，
+    单个样本的得分为剂量向量与权重向量的点积。
+    """
+
+    def __init__(self, rsids, effect_alleles, weights, sources):
+        self.rsids = rsids
+        self.index = {rsid: i for i, rsid in enumerate(rsids)}
+        self.effect_alleles = np.asarray(effect_alleles, dtype=str)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.sources = sources
+
+    @classmethod
+    def load(cls, prs_db):
+        cursor = db_pool.execute(prs_db, "SELECT rsID, effect_allele, effect_weight, source FROM prs_brca")
+        rsids, effect_alleles, weights, sources = [], [], [], []
+        seen = set()
+        for rsid, effect_allele, weight, source in cursor:
+            if rsid in seen:
+                continue
+            seen.add(rsid)
+            rsids.append(rsid)
+            effect_alleles.append(effect_allele or '')
+            weights.append(float(weight))
+            sources.append(source)
+        return cls(rsids, effect_alleles, weights, sources)
+
+    def __len__(self):
+        return len(self.rsids)
+
+    def dosage_vector(self, genotypes):
+        """
+        genotypes: {rsID: 基因型字符串，如 'A/G' 或 'AT|A'}
+        返回长度为权重表位点数的剂量向量，剂量为与效应等位基因完全相同的等位基因个数。
+        """
+        dosage = np.zeros(len(self), dtype=np.float64)
+        idx, alleles = [], []
+        for rsid, genotype in genotypes.items():
+            i = self.index.get(rsid)
+            if i is None or not genotype or genotype == 'NA':
+                continue
+            pair = genotype.replace('|', '/').split('/')
+            idx.append(i)
+            alleles.append((pair + [''])[:2])
+
+        if idx:
+            idx = np.asarray(idx, dtype=np.int64)
+            alleles = np.asarray(alleles, dtype=str)
+            dosage[idx] = (alleles == self.effect_alleles[idx][:, None]).sum(axis=1)
+        return dosage
+
+    def score_matrix(self, genotype_maps):
+        """对多个样本/任务同时打分：剂量矩阵 (样本数, 位点数) 与权重向量相乘"""
+        if not genotype_maps:
+            return np.zeros(0, dtype=np.float64)
+        dosages = np.vstack([self.dosage_vector(g) for g in genotype_maps])
+        return dosages @ self.weights
+
+
+def get_prs_weights(prs_db=DEFAULT_PRS_DB):
+    """返回 prs_db 的权重表，每个进程只从数据库加载一次"""
+    weights = _weights_cache.get(prs_db)
+    if weights is not None:
+        return weights
+    with _weights_lock:
+        weights = _weights_cache.get(prs_db)
+        if weights is None:
+            weights = PRSWeights.load(prs_db)
+            _weights_cache[prs_db] = weights
+            print(f"[PRS] 已加载权重表: {len(weights)} 个位点")
+        return weights
+
+
+def _genotype_map(variants):
+    # 按 rsID 存储基因型，重复 rsID 以最后一条记录为准
+    return {
+        v['variant_info']['id']: v['variant_info'].get('genotype', '')
+        for v in variants
+        if 'id' in v.get('variant_info', {})
+    }
+
+
+def compute_prs(variants, prs_db=DEFAULT_PRS_DB, verbose=False):
+
+    # 0. 从变异中提取rsID及基因型
+    genotypes = _genotype_map(variants)
+
+    if not genotypes:
         print("[PRS] 输入变异列表为空或无rsID")
         return 0.0, 0
-    
-    # 1. 连接数据库查询PRS信息
-    conn = sqlite3.connect(prs_db)
-    placeholders = ",".join("?" for _ in rsids)
-    query = f"SELECT rsID, effect_allele, effect_weight, source FROM prs_brca WHERE rsID IN ({placeholders})"
-    cursor = conn.execute(query, rsids)
-    prs_data = cursor.fetchall()
-    conn.close()
-
-    # 转成字典
-    prs_dict = {
-        row[0]: {'effect_allele': row[1], 'effect_weight': float(row[2]), 'source': row[3]}
-        for row in prs_data
-    }
 
-    # 2. 预处理变异数据：将所有VCF中的变异按rsID存入字典
-    var_dict = {
-        v['variant_info']['id']: v['variant_info']
-        for v in variants 
-        if 'id' in v['variant_info']
-    }
+    # 1. 获取预加载的权重表
+    weights = get_prs_weights(prs_db)
+
+    # 2. 一次性计算剂量向量并与权重做点积
+    dosage = weights.dosage_vector(genotypes)
+    score = float(dosage @ weights.weights)
+    matched_snps = int(np.count_nonzero(dosage))
+    unmatched_snps = sum(1 for rsid in genotypes if rsid not in weights.index)
+
+    if verbose:
+        for i in np.flatnonzero(dosage):
+            print(f"[PRS] 匹配 {weights.rsids[i]}: 基因型={genotypes[weights.rsids[i]]} (剂量={int(dosage[i])}) "
+                  f"| 权重={weights.weights[i]} 来源={weights.sources[i]}")
 
-    # 3. 初始化PRS得分、匹配计数器
-    score = 0.0
-    matched_snps = 0
-    unmatched_snps = 0  
-
-    # 4. 遍历每个PRS权重位点进行匹配和计算
-    for rsid in rsids:
-        if rsid not in prs_dict:
-            unmatched_snps += 1
-            continue
-        
-        # 解析基因型并计算剂量
-        effect_allele = prs_dict[rsid]['effect_allele']
-        weight = prs_dict[rsid]['effect_weight']
-        source = prs_dict[rsid].get('source', 'NA')
-
-        genotype = var_dict.get(rsid, {}).get('genotype', '')
-        dosage = genotype.count(effect_allele)
-        
-        # 若存在匹配剂量则累计得分
-        if dosage > 0:
-            score += dosage * weight
-            matched_snps += 1
-            if verbose:
-                print(f"[PRS] 匹配 {rsid}: 基因型={genotype} (剂量={dosage}) | 权重={weight} 来源={source} | 累计得分={score:.2f}")
-
-    # 5. 打印最终统计信息
+    # 3. 打印最终统计信息
     final_score = round(score, 4)
     print(f"[PRS] 最终得分: {final_score}")
-    print(f"[PRS] 匹配位点数: {matched_snps} | 未匹配位点数: {unmatched_snps} | 总PRS位点: {len(rsids)}")
+    print(f"[PRS] 匹配位点数: {matched_snps} | 未匹配位点数: {unmatched_snps} | 总PRS位点: {len(genotypes)}")
     
     return final_score, matched_snps
 
 
+def compute_prs_batch(variant_lists, prs_db=DEFAULT_PRS_DB):
+    """对多个任务的变异列表同时计算 PRS 得分，返回得分列表"""
+    weights = get_prs_weights(prs_db)
+    scores = weights.score_matrix([_genotype_map(variants) for variants in variant_lists])
+    return [round(float(s), 4) for s in scores]
+
+
 def classify_risk(score, gender="female"):
 
     # 女性乳腺癌阈值 
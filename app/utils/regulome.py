@@ -1,6 +1,159 @@
-import sqlite3
+import os
+import threading
+import numpy as np
+from app.utils import db_pool
 
-def query_score(position, db_path='./data/regulome/regulome.db', verbose=False):
+DEFAULT_DB_PATH = './data/regulome/regulome.db'
+# 区间索引保存在数据库旁边，例如 regulome.db.interval_index.npz
+INDEX_SUFFIX = '.interval_index.npz'
+BATCH_CHUNK_SIZE = 400
+
+_SELECT_COLUMNS = "chrom, start, end, rsid, ranking, score"
+
+_index_lock = threading.Lock()
+_indexes = {}
+
+
+class IntervalIndex:
+    """
+    RegulomeDB 区间索引：每条染色体一组按 start 排序的数组 (starts, ends, rowids)
+    和该染色体上的最大区间长度 max_len。包含 pos 的区间的 start 一定落在
+    [pos - max_len, pos] 内，两次二分查找即可确定候选范围，
+    扫描量只取决于该窗口内的区间数（RegulomeDB 区间很短），与染色体上的区间总数无关。
+    多个区间同时包含 pos 时返回 start 最大（最靠近 pos）的那个，start 相同时取 rowid 较大者。
+    """
+
+    def __init__(self, chroms, source):
+        self.chroms = chroms
+        self.source = source
+
+    @classmethod
+    def build(cls, db_path):
+        cursor = db_pool.execute(
+            db_path, "SELECT chrom, start, end, rowid FROM regulome ORDER BY chrom, start, rowid")
+        chroms = {}
+        current, rows = None, []
+        for chrom, start, end, rowid in cursor:
+            if chrom != current:
+                if rows:
+                    chroms[current] = cls._to_arrays(rows)
+                current, rows = chrom, []
+            rows.append((start, end, rowid))
+        if rows:
+            chroms[current] = cls._to_arrays(rows)
+        return cls(chroms, _source_signature(db_path))
+
+    @staticmethod
+    def _to_arrays(rows):
+        data = np.asarray(rows, dtype=np.int64)
+        starts, ends, rowids = data[:, 0].copy(), data[:, 1].copy(), data[:, 2].copy()
+        max_len = np.int64((ends - starts).max()) if len(starts) else np.int64(0)
+        return starts, ends, max_len, rowids
+
+    @classmethod
+    def load(cls, index_path):
+        with np.load(index_path, allow_pickle=False) as data:
+            names = [str(c) for c in data['chroms']]
+            chroms = {
+                name: (data[f'start_{i}'], data[f'end_{i}'], data[f'max_len_{i}'][()], data[f'rowid_{i}'])
+                for i, name in enumerate(names)
+            }
+            source = tuple(int(x) for x in data['source'])
+        return cls(chroms, source)
+
+    def save(self, index_path):
+        arrays = {
+            'chroms': np.array(list(self.chroms.keys()), dtype=str),
+            'source': np.array(self.source, dtype=np.int64),
+        }
+        for i, (starts, ends, max_len, rowids) in enumerate(self.chroms.values()):
+            arrays[f'start_{i}'] = starts
+            arrays[f'end_{i}'] = ends
+            arrays[f'max_len_{i}'] = np.asarray(max_len, dtype=np.int64)
+            arrays[f'rowid_{i}'] = rowids
+        tmp_path = index_path + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, index_path)
+
+    def lookup(self, chrom, pos):
+        """返回包含 pos 的区间的 rowid，找不到返回 None"""
+        rowids = self.lookup_many(chrom, [pos])
+        return None if rowids[0] < 0 else int(rowids[0])
+
+    def lookup_many(self, chrom, positions):
+        """批量查询同一条染色体上的多个位置，未命中的位置返回 -1"""
+        positions = np.asarray(positions, dtype=np.int64)
+        result = np.full(len(positions), -1, dtype=np.int64)
+        arrays = self.chroms.get(chrom)
+        if arrays is None or len(positions) == 0:
+            return result
+        starts, ends, max_len, rowids = arrays
+
+        # 候选区间的下标范围 [lo, hi)：start 位于 [pos - max_len, pos]
+        his = np.searchsorted(starts, positions, side='right')
+        los = np.searchsorted(starts, positions - max_len, side='left')
+        for k, (lo, hi, pos) in enumerate(zip(los, his, positions)):
+            # 从 start 最大的候选开始向左检查，第一个覆盖 pos 的即为结果
+            for i in range(hi - 1, lo - 1, -1):
+                if ends[i] >= pos:
+                    result[k] = rowids[i]
+                    break
+        return result
+
+
+def _source_signature(db_path):
+    stat = os.stat(db_path)
+    return (int(stat.st_mtime), int(stat.st_size))
+
+
+def get_interval_index(db_path=DEFAULT_DB_PATH):
+    """
+    返回 db_path 对应的区间索引。优先读取数据库旁已保存的索引文件，
+    若不存在或与数据库不一致则从 regulome 表重建并保存。
+    """
+    index = _indexes.get(db_path)
+    if index is not None:
+        return index
+
+    with _index_lock:
+        index = _indexes.get(db_path)
+        if index is not None:
+            return index
+
+        index_path = db_path + INDEX_SUFFIX
+        signature = _source_signature(db_path)
+        if os.path.exists(index_path):
+            try:
+                index = IntervalIndex.load(index_path)
+                if index.source != signature:
+                    index = None
+            except Exception as e:
+                print(f"[WARNING][regulome] 区间索引读取失败，将重建: {e}")
+                index = None
+
+        if index is None:
+            print(f"[INFO][regulome] 构建 RegulomeDB 区间索引: {index_path}")
+            index = IntervalIndex.build(db_path)
+            try:
+                index.save(index_path)
+            except Exception as e:
+                print(f"[WARNING][regulome] 区间索引保存失败: {e}")
+
+        _indexes[db_path] = index
+        return index
+
+
+def _row_to_score(row):
+    return {
+        'chrom': row[0],
+        'pos': row[1],
+        'rsid': row[3],
+        'ranking': row[4],
+        'probability_score': row[5]
+    }
+
+
+def query_score(position, db_path=DEFAULT_DB_PATH, verbose=False):
     try:
         rsid = position.get('rsid')
         chrom = position.get('chrom')
@@ -10,37 +163,28 @@ def query_score(position, db_path='./data/regulome/regulome.db', verbose=False):
         if verbose:
             print(f"[INFO][query_score] 查询位点 {key} 的 RegulomeDB 注释...")
 
-        # 在当前线程中打开数据库连接
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
+        # 复用当前线程的只读连接
         if rsid:
-            cursor.execute("SELECT chrom, start, end, rsid, ranking, score FROM regulome WHERE rsid = ?", (rsid,))
+            cursor = db_pool.execute(db_path, f"SELECT {_SELECT_COLUMNS} FROM regulome WHERE rsid = ?", (rsid,))
+            row = cursor.fetchone()
         elif None not in (chrom, pos):
-            cursor.execute(
-                "SELECT chrom, start, end, rsid, ranking, score FROM regulome WHERE chrom = ? AND start <= ? AND end >= ?",
-                (chrom, pos)
-            )
+            # 位置查询走区间索引
+            rowid = get_interval_index(db_path).lookup(chrom, int(pos))
+            row = None
+            if rowid is not None:
+                cursor = db_pool.execute(db_path, f"SELECT {_SELECT_COLUMNS} FROM regulome WHERE rowid = ?", (rowid,))
+                row = cursor.fetchone()
         else:
             if verbose:
                 print(f"[WARNING][query_score] 位点信息不完整: {position}")
             return 'Invalid input'
 
-        row = cursor.fetchone()
-        conn.close()
-
         if not row:
             if verbose:
                 print(f"[INFO][query_score] RegulomeDB 无匹配记录: {key}")
             return 'Not Found'
 
-        score_info = {
-            'chrom': row[0],
-            'pos': row[1],
-            'rsid': row[3],
-            'ranking': row[4],
-            'probability_score': row[5]
-        }
+        score_info = _row_to_score(row)
         if verbose:
             print(f"[INFO][query_score] 成功找到 {key} 的注释: {score_info}")
         return score_info
@@ -51,4 +195,77 @@ def query_score(position, db_path='./data/regulome/regulome.db', verbose=False):
         return 'Error'
 
 
+def query_scores(positions, db_path=DEFAULT_DB_PATH, chunk_size=BATCH_CHUNK_SIZE):
+    """
+    批量版本的 query_score，positions 为 {'rsid', 'chrom', 'pos'} 字典列表，
+    返回与输入一一对应的结果列表（取值与 query_score 相同）。
+    rsID 通过分块 IN (...) 查询，位置通过区间索引按染色体批量二分查找。
+    """
+    results = ['Invalid input'] * len(positions)
+    rsid_targets = {}
+    loc_targets = {}
+
+    for i, position in enumerate(positions):
+        rsid = position.get('rsid')
+        chrom = position.get('chrom')
+        pos = position.get('pos')
+        if rsid:
+            rsid_targets.setdefault(rsid, []).append(i)
+        elif None not in (chrom, pos):
+            try:
+                loc_targets.setdefault(chrom, []).append((i, int(pos)))
+            except (TypeError, ValueError):
+                continue
+
+    try:
+        # 1. rsID 查询
+        rsids = list(rsid_targets)
+        found = {}
+        for start in range(0, len(rsids), chunk_size):
+            chunk = rsids[start:start + chunk_size]
+            placeholders = ",".join("?" for _ in chunk)
+            cursor = db_pool.execute(
+                db_path, f"SELECT {_SELECT_COLUMNS} FROM regulome WHERE rsid IN ({placeholders})", chunk)
+            for row in cursor:
+                found.setdefault(row[3], row)
+        for rsid, indices in rsid_targets.items():
+            row = found.get(rsid)
+            for i in indices:
+                results[i] = _row_to_score(row) if row else 'Not Found'
+
+        # 2. 位置查询
+        if loc_targets:
+            index = get_interval_index(db_path)
+            hits = {}
+            for chrom, items in loc_targets.items():
+                rowids = index.lookup_many(chrom, [pos for _, pos in items])
+                for (i, _), rowid in zip(items, rowids):
+                    if rowid >= 0:
+                        hits[i] = int(rowid)
+                    else:
+                        results[i] = 'Not Found'
+
+            unique_rowids = sorted(set(hits.values()))
+            rows = {}
+            for start in range(0, len(unique_rowids), chunk_size):
+                chunk = unique_rowids[start:start + chunk_size]
+                placeholders = ",".join("?" for _ in chunk)
+                cursor = db_pool.execute(
+                    db_path,
+                    f"SELECT rowid, {_SELECT_COLUMNS} FROM regulome WHERE rowid IN ({placeholders})", chunk)
+                for row in cursor:
+                    rows[row[0]] = row[1:]
+            for i, rowid in hits.items():
+                row = rows.get(rowid)
+                results[i] = _row_to_score(row) if row else 'Not Found'
+
+    except Exception as e:
+        print(f"[ERROR][query_scores] 批量查询失败: {e}")
+        for indices in rsid_targets.values():
+            for i in indices:
+                results[i] = 'Error'
+        for items in loc_targets.values():
+            for i, _ in items:
+                results[i] = 'Error'
 
+    return results
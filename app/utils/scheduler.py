@@ -0,0 +1,123 @@
+import threading
+import traceback
+from collections import deque
+
+DEFAULT_LANE = 'default'
+FAST_LANE = 'fast'
+
+
+class JobScheduler:
+    """
+    有界的后台任务调度器：固定数量的工作线程从 FIFO 队列取任务执行。
+    - default 通道：VCF 等耗时任务
+    - fast 通道：rsID 等单变异查询，由专用工作线程处理，
+      default 工作线程空闲时也会优先处理 fast 通道中的任务
+    队列只存在于当前进程。多 worker 部署时，跨进程一致的排队位置和取消标记
+    由任务存储（task_store.queue_position / transition）提供，
+    任务开始执行前会检查任务存储中的状态，已取消的任务直接跳过。
+    """
+
+    def __init__(self, workers=2, fast_workers=1):
+        self._queues = {DEFAULT_LANE: deque(), FAST_LANE: deque()}
+        self._cond = threading.Condition()
+        self._running = set()
+        self._shutdown = False
+        self._threads = []
+
+        for i in range(max(1, workers)):
+            self._start_worker(f"job-worker-{i}", (FAST_LANE, DEFAULT_LANE))
+        for i in range(max(0, fast_workers)):
+            self._start_worker(f"job-fast-worker-{i}", (FAST_LANE,))
+
+    def _start_worker(self, name, lanes):
+        thread = threading.Thread(target=self._worker_loop, args=(lanes,), name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def submit(self, task_id, fn, args=(), lane=DEFAULT_LANE):
+        """将任务加入队列，返回排队位置（从 1 开始）"""
+        if lane not in self._queues:
+            raise ValueError(f"未知的任务通道: {lane}")
+        with self._cond:
+            queue = self._queues[lane]
+            queue.append((task_id, fn, args))
+            self._cond.notify_all()
+            return len(queue)
+
+    def position(self, task_id):
+        """返回任务在本进程队列中的位置（从 1 开始）；已开始执行或不存在时返回 None"""
+        with self._cond:
+            for queue in self._queues.values():
+                for i, job in enumerate(queue):
+                    if job[0] == task_id:
+                        return i + 1
+        return None
+
+    def cancel(self, task_id):
+        """从本进程队列中移除尚未开始执行的任务，成功返回 True"""
+        with self._cond:
+            for queue in self._queues.values():
+                for job in queue:
+                    if job[0] == task_id:
+                        queue.remove(job)
+                        return True
+        return False
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': {lane: len(queue) for lane, queue in self._queues.items()},
+                'running': len(self._running),
+                'workers': len(self._threads),
+            }
+
+    def shutdown(self):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+
+    def _next_job(self, lanes):
+        for lane in lanes:
+            if self._queues[lane]:
+                return self._queues[lane].popleft()
+        return None
+
+    def _worker_loop(self, lanes):
+        while True:
+            with self._cond:
+                job = self._next_job(lanes)
+                while job is None and not self._shutdown:
+                    self._cond.wait()
+                    job = self._next_job(lanes)
+                if job is None:
+                    return
+                task_id, fn, args = job
+                self._running.add(task_id)
+
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"[ERROR][{task_id}] 后台任务异常: {e}")
+                traceback.print_exc()
+            finally:
+                with self._cond:
+                    self._running.discard(task_id)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def init_scheduler(workers=2, fast_workers=1):
+    """创建全局调度器；重复调用时返回已有实例"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler(workers=workers, fast_workers=fast_workers)
+        return _scheduler
+
+
+def get_scheduler():
+    if _scheduler is None:
+        return init_scheduler()
+    return _scheduler
@@ -0,0 +1,183 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import numpy as np
+from app.utils.prediction_cache import normalize_key
+from predict.model.dataset import DB_PATH as CLINVAR_DB, TABLE_NAME as CLINVAR_TABLE
+
+# 离线预计算的逐位点预测得分：每个基因区间一个 float32 数组，覆盖
+# [该基因在 brca_clinvar.db 中最小位置 - flank, 最大位置 + flank]。
+# 在线流程的 variant_info 不带基因，推理时基因编码为“未知”；得分表按同样的编码计算，
+# 按 (chrom, pos) 查询，只对编码相同的请求生效
+SCORE_TABLE_DIR = "data/cache/score_table"
+MANIFEST_NAME = "manifest.json"
+TABLE_FORMAT = 2
+DEFAULT_FLANK = 2000
+SWEEP_BATCH_SIZE = 256
+
+
+def gene_regions(gene_encoder, db_path=CLINVAR_DB, flank=DEFAULT_FLANK):
+    """
+    由 brca_clinvar.db 推断 gene_encoder.classes_ 中每个基因的区间，返回
+    [(gene, chrom, start, end)]（1-based，闭区间）。基因出现在多条染色体上时取变异最多的一条。
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            f"SELECT gene, chrom, MIN(pos), MAX(pos), COUNT(*) FROM {CLINVAR_TABLE} "
+            f"WHERE gene IS NOT NULL AND pos IS NOT NULL GROUP BY gene, chrom"
+        ).fetchall()
+    finally:
+        conn.close()
+
+    best = {}
+    for gene, chrom, start, end, count in rows:
+        if gene not in best or count > best[gene][3]:
+            best[gene] = (chrom, int(start), int(end), count)
+
+    regions = []
+    for gene in gene_encoder.classes_:
+        if gene in best and gene != 'None':
+            chrom, start, end, _ = best[gene]
+            chrom = normalize_key(chrom, 0, gene)[0]
+            regions.append((gene, chrom, max(1, start - flank), end + flank))
+    return regions
+
+
+class ScoreTable:
+    """按 (chrom, pos) 查表；数组以内存映射方式读取"""
+
+    def __init__(self, table_dir=SCORE_TABLE_DIR):
+        self.table_dir = table_dir
+        with open(os.path.join(table_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        # 权重校验和 + 推理后端 + 量化模式，与预测缓存的 model_key 相同
+        self.model_key = manifest.get('model_key')
+        self.format = manifest.get('format')
+        # 计算得分时使用的基因编码（gene_encoder 中的下标）
+        self.gene_index = manifest.get('gene_index')
+        self.flank = manifest.get('flank')
+        self.genes = manifest['genes']   # gene → {'chrom', 'start', 'length', 'file'}
+        self._by_chrom = {}
+        for gene, entry in self.genes.items():
+            self._by_chrom.setdefault(entry['chrom'], []).append((entry['start'], entry['length'], gene))
+        self._scores = {}
+
+    def _scores_for(self, gene):
+        scores = self._scores.get(gene)
+        if scores is None:
+            scores = np.load(os.path.join(self.table_dir, self.genes[gene]['file']), mmap_mode='r')
+            self._scores[gene] = scores
+        return scores
+
+    def lookup(self, chrom, pos):
+        """chrom 不带 chr 前缀；不在表内时返回 None"""
+        for start, length, gene in self._by_chrom.get(chrom, ()):
+            offset = pos - start
+            if 0 <= offset < length:
+                return float(self._scores_for(gene)[offset])
+        return None
+
+    def __len__(self):
+        return sum(entry['length'] for entry in self.genes.values())
+
+
+def build_score_table(model, gene_encoder, model_key, table_dir=SCORE_TABLE_DIR, flank=DEFAULT_FLANK,
+                      batch_size=SWEEP_BATCH_SIZE, db_path=CLINVAR_DB):
+    """
+    对所有基因区间逐位点批量推理并写入得分表。model_key 为 get_model_info()['cache_key']。
+    推理时不带基因（与在线流程的 variant_info 一致），清单中记录对应的基因编码。
+    每完成一个基因即更新清单，中断后重新运行会跳过已完成且 model_key 一致的基因。
+    """
+    from app.utils.predict import _run_batch, _encode_gene
+
+    os.makedirs(table_dir, exist_ok=True)
+    manifest_path = os.path.join(table_dir, MANIFEST_NAME)
+    manifest = {'format': TABLE_FORMAT, 'model_key': model_key, 'gene_index': _encode_gene(gene_encoder, None),
+                'flank': flank, 'genes': {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous = json.load(f)
+        if all(previous.get(k) == manifest[k] for k in ('format', 'model_key', 'gene_index', 'flank')):
+            manifest = previous
+
+    regions = gene_regions(gene_encoder, db_path=db_path, flank=flank)
+    total = sum(end - start + 1 for _, _, start, end in regions)
+    print(f"[INFO] 预计算 {len(regions)} 个基因区间，共 {total} 个位点")
+
+    for gene, chrom, start, end in regions:
+        length = end - start + 1
+        entry = manifest['genes'].get(gene)
+        if entry and entry['chrom'] == chrom and entry['start'] == start and entry['length'] == length:
+            continue
+
+        began = time.perf_counter()
+        file_name = f"{gene}.npy"
+        tmp_path = os.path.join(table_dir, file_name + ".tmp.npy")
+        scores = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(length,))
+        for offset in range(0, length, batch_size):
+            positions = range(start + offset, min(start + offset + batch_size, end + 1))
+            infos = [{'id': f"{chrom}:{pos}", 'chrom': chrom, 'pos': pos} for pos in positions]
+            scores[offset:offset + len(infos)] = _run_batch(model, gene_encoder, infos)
+        scores.flush()
+        del scores
+        os.replace(tmp_path, os.path.join(table_dir, file_name))
+
+        manifest['genes'][gene] = {'chrom': chrom, 'start': start, 'length': length, 'file': file_name}
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        print(f"[INFO] {gene} ({chrom}:{start}-{end}) 完成，耗时 {time.perf_counter() - began:.1f}s")
+
+    return ScoreTable(table_dir)
+
+
+_table = None
+_table_state = None   # (model_key, table_dir, 清单 mtime)，清单不存在时 mtime 为 None
+_table_lock = threading.Lock()
+
+
+def _manifest_mtime(table_dir):
+    try:
+        return os.path.getmtime(os.path.join(table_dir, MANIFEST_NAME))
+    except OSError:
+        return None
+
+
+def get_score_table(model_key, table_dir=SCORE_TABLE_DIR):
+    """
+    返回与 model_key（权重校验和 + 后端 + 量化模式）一致的得分表；不存在或不一致时返回 None。
+    清单文件变化后（服务运行期间构建或补充了得分表）重新读取。
+    """
+    global _table, _table_state
+    state = (model_key, table_dir, _manifest_mtime(table_dir))
+    if _table_state == state:
+        return _table
+    with _table_lock:
+        if _table_state != state:
+            _table = None
+            if state[2] is not None:
+                try:
+                    table = ScoreTable(table_dir)
+                    if table.format == TABLE_FORMAT and table.model_key == model_key:
+                        _table = table
+                        print(f"[INFO] 已加载预计算得分表: {len(table.genes)} 个基因, {len(table)} 个位点")
+                    else:
+                        print("[WARNING] 预计算得分表与当前模型或推理配置不一致，已忽略，请重新运行 score_table")
+                except Exception as e:
+                    print(f"[WARNING] 预计算得分表读取失败: {e}")
+            _table_state = state
+        return _table
+
+
+if __name__ == "__main__":
+    # 用法: python -m app.utils.score_table [flank] [batch_size]
+    from app.utils.predict import get_model, get_model_info
+
+    flank = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_FLANK
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else SWEEP_BATCH_SIZE
+    model, gene_encoder = get_model()
+    build_score_table(model, gene_encoder, get_model_info()['cache_key'], flank=flank, batch_size=batch_size)
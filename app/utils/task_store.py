@@ -0,0 +1,392 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+DEFAULT_TASK_DB = "data/cache/tasks.db"
+DEFAULT_TTL = 24 * 3600          # 任务保留时间（秒）
+EVICT_INTERVAL = 600             # 两次过期清理之间的最短间隔（秒）
+
+# 单独成列的小字段，其余字段存入 meta JSON，result 单独存放并按需加载
+_COLUMNS = ('status', 'progress', 'task_type')
+_RESULT_KEY = 'result'
+
+# 排队与执行中的任务状态；取消和开始执行都是从 QUEUED 出发的原子状态转换，
+# 保证多个 gunicorn worker 之间对同一任务只有一方成功
+QUEUED = 'queued'
+PROCESSING = 'processing'
+
+# 进程重启后内存中的任务队列丢失，其遗留的排队 / 执行中任务标记为失败
+ORPHANED_MESSAGE = '服务已重启，任务被中断，请重新提交'
+
+
+def _current_owner():
+    """任务所属的进程：主机名:pid（每次调用时取 pid，兼容 gunicorn fork 出的 worker）"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner):
+    """
+    同一主机上检查进程是否仍在运行；其他主机的进程无法判断，视为存活。
+    pid 被其他进程复用时会误判为存活，此类任务仍会在 TTL 后被清理。
+    """
+    host, _, pid = (owner or '').rpartition(':')
+    if host != socket.gethostname():
+        return bool(owner)
+    try:
+        pid = int(pid)
+    except ValueError:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MemoryTaskStore:
+    """进程内任务存储，仅适用于单进程部署"""
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._tasks = {}
+        self._created = {}
+        self._lock = threading.Lock()
+        self._last_evict = time.time()
+
+    def __setitem__(self, task_id, fields):
+        with self._lock:
+            self._tasks[task_id] = dict(fields)
+            self._created[task_id] = time.time()
+        self._maybe_evict()
+
+    def __getitem__(self, task_id):
+        return self._tasks[task_id]
+
+    def __contains__(self, task_id):
+        return task_id in self._tasks
+
+    def get(self, task_id, default=None):
+        return self._tasks.get(task_id, default)
+
+    def transition(self, task_id, expected_status, fields):
+        """仅当任务状态为 expected_status 时更新字段，返回是否更新成功"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None or task.get('status') != expected_status:
+                return False
+            task.update(fields)
+            return True
+
+    def queue_position(self, task_id):
+        """同一 task_type 中排在该任务之前（含自身）的排队任务数；未在排队时返回 None"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None or task.get('status') != QUEUED:
+                return None
+            created = self._created[task_id]
+            return sum(
+                1 for tid, other in self._tasks.items()
+                if other.get('status') == QUEUED and other.get('task_type') == task.get('task_type')
+                and self._created[tid] <= created
+            )
+
+    def queue_counts(self):
+        """返回 {'queued': {task_type: 数量}, 'processing': 数量}"""
+        counts = {'queued': {}, 'processing': 0}
+        with self._lock:
+            for task in self._tasks.values():
+                if task.get('status') == QUEUED:
+                    task_type = task.get('task_type')
+                    counts['queued'][task_type] = counts['queued'].get(task_type, 0) + 1
+                elif task.get('status') == PROCESSING:
+                    counts['processing'] += 1
+        return counts
+
+    def evict_expired(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [tid for tid, created in self._created.items() if created < cutoff]
+            for tid in expired:
+                self._tasks.pop(tid, None)
+                self._created.pop(tid, None)
+            self._last_evict = time.time()
+        return len(expired)
+
+    def _maybe_evict(self):
+        if time.time() - self._last_evict > EVICT_INTERVAL:
+            self.evict_expired()
+
+
+class TaskHandle:
+    """
+    SQLite 任务记录的字典式视图：读取小字段走内存副本，
+    写入立即落盘；'result' 只在访问时从数据库加载。
+    """
+
+    def __init__(self, store, task_id, fields):
+        self._store = store
+        self._task_id = task_id
+        self._fields = fields
+
+    def __getitem__(self, key):
+        if key == _RESULT_KEY:
+            result = self._store.load_result(self._task_id)
+            if result is None:
+                raise KeyError(key)
+            return result
+        return self._fields[key]
+
+    def __setitem__(self, key, value):
+        self._store.update(self._task_id, {key: value})
+        if key != _RESULT_KEY:
+            self._fields[key] = value
+
+    def __contains__(self, key):
+        if key == _RESULT_KEY:
+            return self._store.has_result(self._task_id)
+        return key in self._fields
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class SQLiteTaskStore:
+    """
+    基于 SQLite (WAL) 的任务存储：服务重启后结果仍可查询，
+    多个 gunicorn worker 可以共享同一个数据库文件。
+    """
+
+    def __init__(self, db_path=DEFAULT_TASK_DB, ttl=DEFAULT_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._last_evict = 0.0
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                status TEXT,
+                progress INTEGER,
+                task_type TEXT,
+                meta TEXT,
+                result TEXT,
+                created_at REAL,
+                updated_at REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_updated ON tasks(updated_at)")
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(tasks)")}
+        if 'owner' not in columns:
+            conn.execute("ALTER TABLE tasks ADD COLUMN owner TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status, created_at)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _split(fields):
+        columns = {k: fields[k] for k in _COLUMNS if k in fields}
+        meta = {k: v for k, v in fields.items() if k not in _COLUMNS and k != _RESULT_KEY}
+        return columns, meta
+
+    def __setitem__(self, task_id, fields):
+        columns, meta = self._split(fields)
+        result = fields.get(_RESULT_KEY)
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO tasks "
+            "(task_id, status, progress, task_type, meta, result, owner, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (task_id, columns.get('status'), columns.get('progress'), columns.get('task_type'),
+             json.dumps(meta, default=str),
+             json.dumps(result, default=str) if result is not None else None,
+             _current_owner(), now, now)
+        )
+        conn.commit()
+        self._maybe_evict()
+
+    def __getitem__(self, task_id):
+        handle = self.get(task_id)
+        if handle is None:
+            raise KeyError(task_id)
+        return handle
+
+    def __contains__(self, task_id):
+        row = self._conn().execute("SELECT 1 FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return row is not None
+
+    def get(self, task_id, default=None):
+        row = self._conn().execute(
+            "SELECT status, progress, task_type, meta FROM tasks WHERE task_id = ? AND updated_at >= ?",
+            (task_id, time.time() - self.ttl)
+        ).fetchone()
+        if row is None:
+            return default
+        status, progress, task_type, meta = row
+        fields = json.loads(meta) if meta else {}
+        for key, value in zip(_COLUMNS, (status, progress, task_type)):
+            if value is not None:
+                fields[key] = value
+        return TaskHandle(self, task_id, fields)
+
+    def update(self, task_id, fields):
+        """更新任务的部分字段"""
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._update(conn, task_id, fields)
+
+    def transition(self, task_id, expected_status, fields):
+        """
+        仅当任务状态为 expected_status 时更新字段（同一事务内检查并写入），返回是否更新成功。
+        用于跨进程的取消 / 开始执行。
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT status FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None or row[0] != expected_status:
+                return False
+            self._update(conn, task_id, fields)
+            return True
+
+    def queue_position(self, task_id):
+        """同一 task_type 中排在该任务之前（含自身）的排队任务数；未在排队时返回 None"""
+        cutoff = time.time() - self.ttl
+        row = self._conn().execute("""
+            SELECT COUNT(*) FROM tasks AS other, tasks AS me
+            WHERE me.task_id = ? AND me.status = ? AND me.updated_at >= ?
+              AND other.status = ? AND other.task_type IS me.task_type
+              AND other.created_at <= me.created_at AND other.updated_at >= ?
+        """, (task_id, QUEUED, cutoff, QUEUED, cutoff)).fetchone()
+        return row[0] or None
+
+    def fail_orphaned(self):
+        """
+        将所属进程已退出的排队 / 执行中任务标记为失败，返回处理数量。
+        这些任务的作业只存在于已退出进程的内存队列中，不会再被执行。
+        """
+        rows = self._conn().execute(
+            "SELECT task_id, owner FROM tasks WHERE status IN (?, ?)", (QUEUED, PROCESSING)).fetchall()
+        failed = 0
+        for task_id, owner in rows:
+            if _owner_alive(owner):
+                continue
+            for expected in (QUEUED, PROCESSING):
+                if self.transition(task_id, expected, {
+                    'status': 'failed',
+                    'progress': 100,
+                    'error_message': ORPHANED_MESSAGE,
+                }):
+                    failed += 1
+                    break
+        return failed
+
+    def queue_counts(self):
+        """返回 {'queued': {task_type: 数量}, 'processing': 数量}"""
+        counts = {'queued': {}, 'processing': 0}
+        rows = self._conn().execute(
+            "SELECT status, task_type, COUNT(*) FROM tasks WHERE status IN (?, ?) AND updated_at >= ? "
+            "GROUP BY status, task_type",
+            (QUEUED, PROCESSING, time.time() - self.ttl)
+        )
+        for status, task_type, count in rows:
+            if status == QUEUED:
+                counts['queued'][task_type] = count
+            else:
+                counts['processing'] += count
+        return counts
+
+    def _update(self, conn, task_id, fields):
+        columns, meta = self._split(fields)
+        sets, params = ["updated_at = ?"], [time.time()]
+        for key, value in columns.items():
+            sets.append(f"{key} = ?")
+            params.append(value)
+        if _RESULT_KEY in fields:
+            sets.append("result = ?")
+            result = fields[_RESULT_KEY]
+            params.append(json.dumps(result, default=str) if result is not None else None)
+        if meta:
+            row = conn.execute("SELECT meta FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            merged = json.loads(row[0]) if row and row[0] else {}
+            merged.update(meta)
+            sets.append("meta = ?")
+            params.append(json.dumps(merged, default=str))
+        params.append(task_id)
+        conn.execute(f"UPDATE tasks SET {', '.join(sets)} WHERE task_id = ?", params)
+
+    def load_result(self, task_id):
+        row = self._conn().execute("SELECT result FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        if not row or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def has_result(self, task_id):
+        row = self._conn().execute(
+            "SELECT result IS NOT NULL FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return bool(row and row[0])
+
+    def evict_expired(self):
+        """删除超过 TTL 未更新的任务，返回删除数量"""
+        conn = self._conn()
+        with conn:
+            cursor = conn.execute("DELETE FROM tasks WHERE updated_at < ?", (time.time() - self.ttl,))
+        self._last_evict = time.time()
+        return cursor.rowcount
+
+    def _maybe_evict(self):
+        if time.time() - self._last_evict > EVICT_INTERVAL:
+            try:
+                removed = self.evict_expired()
+                if removed:
+                    print(f"[INFO] 清理过期任务 {removed} 个")
+            except Exception as e:
+                print(f"[WARNING] 清理过期任务失败: {e}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def init_task_store(backend='sqlite', db_path=DEFAULT_TASK_DB, ttl=DEFAULT_TTL):
+    """根据配置创建全局任务存储，backend 可选 'sqlite' 或 'memory'"""
+    global _store
+    with _store_lock:
+        if backend == 'memory':
+            _store = MemoryTaskStore(ttl=ttl)
+        elif backend == 'sqlite':
+            _store = SQLiteTaskStore(db_path=db_path, ttl=ttl)
+            try:
+                failed = _store.fail_orphaned()
+                if failed:
+                    print(f"[WARNING] {failed} 个任务因服务重启被中断，已标记为失败")
+            except Exception as e:
+                print(f"[WARNING] 检查中断任务失败: {e}")
+        else:
+            raise ValueError(f"未知的任务存储后端: {backend}")
+        return _store
+
+
+def get_task_store():
+    """返回全局任务存储，未初始化时使用默认的 SQLite 后端"""
+    if _store is None:
+        return init_task_store()
+    return _store
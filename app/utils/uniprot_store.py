@@ -0,0 +1,259 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# 本地 UniProt/Swiss-Prot FASTA（需解压），可合并 isoform 文件 uniprot_sprot_varsplic.fasta
+UNIPROT_FASTA = os.environ.get("UNIPROT_FASTA", "data/uniprot/uniprot_sprot.fasta")
+# 偏移索引保存在 FASTA 旁边，例如 uniprot_sprot.fasta.idx.db
+INDEX_SUFFIX = ".idx.db"
+INSERT_BATCH = 10000
+
+# 在线获取的序列缓存（SQLite WAL），旧版 JSON 缓存首次打开时一次性迁移
+SEQ_CACHE_DB = "data/cache/uniprot_seq_cache.db"
+LEGACY_JSON_CACHE = "data/cache/uniprot_seq_cache.json"
+LRU_SIZE = 2048               # 内存 LRU 前端保留的序列条数
+
+
+def _source_signature(fasta_path):
+    stat = os.stat(fasta_path)
+    return f"{int(stat.st_mtime)}:{stat.st_size}"
+
+
+def _parse_accession(header):
+    """'>sp|P38398-2|BRCA1_HUMAN ...' → 'P38398-2'；非 UniProt 格式时取第一个字段"""
+    token = header[1:].split(None, 1)[0]
+    parts = token.split("|")
+    return parts[1] if len(parts) >= 3 else token
+
+
+class UniProtSequenceStore:
+    """
+    本地 UniProt 序列库：为 FASTA 建立 SQLite 偏移索引
+    (accession → 序列起始字节, 字节数)，按登录号或 isoform 随机读取，复杂度 O(1)。
+    """
+
+    def __init__(self, fasta_path, index_path):
+        self.fasta_path = fasta_path
+        self.index_path = index_path
+        self._fd = os.open(fasta_path, os.O_RDONLY)
+        self._local = threading.local()
+
+    @classmethod
+    def build(cls, fasta_path, index_path=None):
+        """扫描 FASTA 生成偏移索引，返回打开的序列库"""
+        if fasta_path.endswith((".gz", ".bgz")):
+            raise ValueError(f"UniProt FASTA 需解压后再导入: {fasta_path}")
+        index_path = index_path or fasta_path + INDEX_SUFFIX
+        tmp_path = index_path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        conn = sqlite3.connect(tmp_path)
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("CREATE TABLE sequences (accession TEXT PRIMARY KEY, offset INTEGER, nbytes INTEGER)")
+
+        rows, count = [], 0
+        accession, start, offset = None, 0, 0
+        with open(fasta_path, "rb") as f:
+            for line in f:
+                if line.startswith(b">"):
+                    if accession is not None:
+                        rows.append((accession, start, offset - start))
+                    accession = _parse_accession(line.decode("ascii", "replace"))
+                    start = offset + len(line)
+                    if len(rows) >= INSERT_BATCH:
+                        conn.executemany("INSERT OR REPLACE INTO sequences VALUES (?, ?, ?)", rows)
+                        count += len(rows)
+                        rows = []
+                offset += len(line)
+        if accession is not None:
+            rows.append((accession, start, offset - start))
+        conn.executemany("INSERT OR REPLACE INTO sequences VALUES (?, ?, ?)", rows)
+        count += len(rows)
+
+        conn.execute("INSERT INTO meta VALUES ('source', ?)", (_source_signature(fasta_path),))
+        conn.commit()
+        conn.close()
+        os.replace(tmp_path, index_path)
+        print(f"[INFO][uniprot] 已索引 {count} 条蛋白序列: {index_path}")
+        return cls(fasta_path, index_path)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            uri = f"file:{os.path.abspath(self.index_path)}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def source(self):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+        return row[0] if row else None
+
+    def get(self, accession):
+        """按登录号读取序列；带 isoform 后缀（如 P38398-2）时精确匹配该 isoform"""
+        row = self._conn().execute(
+            "SELECT offset, nbytes FROM sequences WHERE accession = ?", (accession,)).fetchone()
+        if row is None:
+            return None
+        offset, nbytes = row
+        data = os.pread(self._fd, nbytes, offset)
+        return data.replace(b"\n", b"").replace(b"\r", b"").decode("ascii")
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sequences").fetchone()[0]
+
+
+_store = None
+_store_checked = False
+_store_lock = threading.Lock()
+
+
+def get_uniprot_store(fasta_path=UNIPROT_FASTA):
+    """
+    返回本地 UniProt 序列库；FASTA 不存在时返回 None。
+    索引缺失或与 FASTA 不一致时自动重建。
+    """
+    global _store, _store_checked
+    if _store_checked:
+        return _store
+
+    with _store_lock:
+        if _store_checked:
+            return _store
+        if not os.path.exists(fasta_path):
+            print(f"[INFO][uniprot] 未找到本地 UniProt FASTA: {fasta_path}")
+        else:
+            index_path = fasta_path + INDEX_SUFFIX
+            store = None
+            if os.path.exists(index_path):
+                try:
+                    store = UniProtSequenceStore(fasta_path, index_path)
+                    if store.source() != _source_signature(fasta_path):
+                        store = None
+                except Exception as e:
+                    print(f"[WARNING][uniprot] 序列索引读取失败，将重建: {e}")
+                    store = None
+            if store is None:
+                try:
+                    store = UniProtSequenceStore.build(fasta_path, index_path)
+                except Exception as e:
+                    print(f"[ERROR][uniprot] 构建序列索引失败: {e}")
+            _store = store
+        _store_checked = True
+        return _store
+
+
+class UniProtSequenceCache:
+    """
+    UniProt 序列键值缓存：SQLite (WAL) 持久化，每条新序列单独追加写入，
+    多线程、多进程并发安全；前端为有界的内存 LRU。
+    """
+
+    def __init__(self, db_path=SEQ_CACHE_DB, legacy_json=LEGACY_JSON_CACHE, lru_size=LRU_SIZE):
+        self.db_path = db_path
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._lru_lock = threading.Lock()
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = self._conn()
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sequences (
+                    accession TEXT PRIMARY KEY,
+                    sequence TEXT,
+                    created_at REAL
+                )
+            """)
+        self._migrate_json(legacy_json)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _migrate_json(self, legacy_json):
+        """将旧版 JSON 缓存导入数据库，只执行一次"""
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+                return
+            migrated = 0
+            if legacy_json and os.path.exists(legacy_json):
+                try:
+                    with open(legacy_json, "r") as f:
+                        legacy = json.load(f)
+                    now = time.time()
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO sequences (accession, sequence, created_at) VALUES (?, ?, ?)",
+                        [(acc, seq, now) for acc, seq in legacy.items() if seq]
+                    )
+                    migrated = len(legacy)
+                except Exception as e:
+                    print(f"[WARNING][uniprot] 旧版 JSON 缓存迁移失败: {e}")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)", (str(migrated),))
+        if migrated:
+            print(f"[INFO][uniprot] 已从 {legacy_json} 迁移 {migrated} 条序列缓存")
+
+    def _remember(self, accession, seq):
+        with self._lru_lock:
+            self._lru[accession] = seq
+            self._lru.move_to_end(accession)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def get(self, accession):
+        with self._lru_lock:
+            seq = self._lru.get(accession)
+            if seq is not None:
+                self._lru.move_to_end(accession)
+                return seq
+        row = self._conn().execute(
+            "SELECT sequence FROM sequences WHERE accession = ?", (accession,)).fetchone()
+        if row is None:
+            return None
+        self._remember(accession, row[0])
+        return row[0]
+
+    def put(self, accession, seq):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sequences (accession, sequence, created_at) VALUES (?, ?, ?)",
+                (accession, seq, time.time())
+            )
+        self._remember(accession, seq)
+
+    def __contains__(self, accession):
+        return self.get(accession) is not None
+
+
+_seq_cache = None
+_seq_cache_lock = threading.Lock()
+
+
+def get_uniprot_cache():
+    """返回全局 UniProt 序列缓存，首次调用时打开数据库"""
+    global _seq_cache
+    with _seq_cache_lock:
+        if _seq_cache is None:
+            _seq_cache = UniProtSequenceCache()
+        return _seq_cache
+
+
+if __name__ == "__main__":
+    # 用法: python -m app.utils.uniprot_store [uniprot_sprot.fasta]
+    path = sys.argv[1] if len(sys.argv) > 1 else UNIPROT_FASTA
+    UniProtSequenceStore.build(path)
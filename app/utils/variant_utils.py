@@ -1,7 +1,7 @@
 from app.utils import clinvar_query, bio_features, regulome, prs
-from app.utils.predict import predict_variant, compute_alt_dosage, load_model
+from app.utils.predict import predict_variants, compute_alt_dosage, get_model
+from app.utils.gene_to_protein import TRANSCRIPT_POLICY
 import traceback
-import torch
 import os
 
 def process_variants(task_id, variants, tasks, file_path=None):
@@ -12,20 +12,19 @@ def process_variants(task_id, variants, tasks, file_path=None):
         success_count = 0
         fail_count = 0
         
+        variant_ids = [v['variant_info'].get('id') for v in variants if 'variant_info' in v]
+        try:
+            clinvar_results = clinvar_query.annotate_bulk(variant_ids)
+        except Exception as e:
+            print(f"[WARNING][{task_id}] ClinVar 注释失败: {e}")
+            clinvar_results = {}
+
         for v in variants:
-            try:
-                if 'variant_info' in v:
-                    rsid = v['variant_info']['id']
-                    result = clinvar_query.query_with_fallback(rsid)
-                    if result:
-                        v['clinvar_data'] = result
-                        success_count += 1
-                    else:
-                        fail_count += 1
-                else:
-                    fail_count += 1
-            except Exception as e:
-                print(f"[WARNING][{task_id}] ClinVar 注释失败: {e}")
+            result = clinvar_results.get(v['variant_info'].get('id')) if 'variant_info' in v else None
+            if result:
+                v['clinvar_data'] = result
+                success_count += 1
+            else:
                 fail_count += 1
 
         print(f"[INFO][{task_id}] ClinVar 注释完成，成功注释: {success_count} 条，未注释: {fail_count} 条")
@@ -36,32 +35,38 @@ def process_variants(task_id, variants, tasks, file_path=None):
         matched_count = 0
         unmatched_count = 0
 
+        pending = []
         for v in variants:
-            try:
-                clinvar = v.get('clinvar_data')
-                if clinvar:
-                    rsid = clinvar.get('ID')
-                    chrom = clinvar.get('Chromosome')
-                    pos = clinvar.get('Pos')
-                    pos_info = {}
-                    if rsid and rsid != 'NA':
-                        pos_info['rsid'] = rsid
-                    if chrom and pos:
-                        pos_info.update({'chrom': chrom, 'pos': pos})
-                    
-                    if pos_info:
-                        score = regulome.query_score(pos_info)
-                        v['regulome_score'] = score
-                        if score != 'Not Found' and score != 'Invalid input' and score != 'Error':
-                            matched_count += 1
-                        else:
-                            unmatched_count += 1
-                    else:
-                        unmatched_count += 1
-                else:
-                    unmatched_count += 1
-            except Exception as e:
-                print(f"[WARNING][{task_id}] RegulomeDB 注释失败: {e}")
+            clinvar = v.get('clinvar_data')
+            if not clinvar:
+                unmatched_count += 1
+                continue
+            rsid = clinvar.get('ID')
+            chrom = clinvar.get('Chromosome')
+            pos = clinvar.get('Pos')
+            pos_info = {}
+            if rsid and rsid != 'NA':
+                pos_info['rsid'] = rsid
+            if chrom and pos:
+                pos_info.update({'chrom': chrom, 'pos': pos})
+
+            if pos_info:
+                pending.append((v, pos_info))
+            else:
+                unmatched_count += 1
+
+        # 批量查询：rsID 分块 IN 查询，位置走区间索引
+        try:
+            scores = regulome.query_scores([pos_info for _, pos_info in pending])
+        except Exception as e:
+            print(f"[WARNING][{task_id}] RegulomeDB 注释失败: {e}")
+            scores = ['Error'] * len(pending)
+
+        for (v, _), score in zip(pending, scores):
+            v['regulome_score'] = score
+            if score != 'Not Found' and score != 'Invalid input' and score != 'Error':
+                matched_count += 1
+            else:
                 unmatched_count += 1
 
         print(f"[INFO][{task_id}] RegulomeDB 注释完成，匹配成功: {matched_count}，未匹配: {unmatched_count}")
@@ -126,48 +131,41 @@ def process_variants(task_id, variants, tasks, file_path=None):
 
         # step5: 模型预测
         try:
-            model, gene_encoder = load_model()
+            model, gene_encoder = get_model()
             print(f"[INFO][{task_id}] 开始模型预测")
 
             total_score = 0.0
             total_dosage = 0.0
-            score_list = []
             variant_count = 0
 
-            with torch.no_grad():
-                for v in variants:
-                    info = v.get("variant_info")
-                    if not info:
-                        continue
+            # 批量前向传播，结果写回 v['predict_result']
+            score_list = predict_variants(model, gene_encoder, variants)
 
-                    ref = info.get("ref")
-                    alt = info.get("alt")
-                    genotype = info.get("genotype", "NA")
-
-                    if ',' in alt:
-                        alt = alt.split(',')[0]
+            for v in variants:
+                info = v.get("variant_info")
+                if not info:
+                    continue
 
-                    dosage = None
-                    try:
-                        dosage = compute_alt_dosage(ref, alt, genotype)
-                    except Exception:
-                        pass
+                ref = info.get("ref")
+                alt = info.get("alt")
+                genotype = info.get("genotype", "NA")
 
-                    score, clnsig_pred = predict_variant(model, gene_encoder, info)
+                if ',' in alt:
+                    alt = alt.split(',')[0]
 
-                    # 记录模型预测结果到当前 v 中
-                    v['predict_result'] = {
-                        'predict_score': score,
-                        'clnsig_pred': clnsig_pred,
-                        }
+                dosage = None
+                try:
+                    dosage = compute_alt_dosage(ref, alt, genotype)
+                except Exception:
+                    pass
 
-                    score_list.append(score)
+                score = v['predict_result']['predict_score']
 
-                    if dosage is not None and isinstance(dosage, (int, float)) and dosage > 0:
-                        total_score += score * dosage
-                        total_dosage += dosage
-                    
-                    variant_count += 1
+                if dosage is not None and isinstance(dosage, (int, float)) and dosage > 0:
+                    total_score += score * dosage
+                    total_dosage += dosage
+                
+                variant_count += 1
 
             if total_dosage > 0:
                 final_score = total_score / total_dosage
@@ -191,6 +189,7 @@ def process_variants(task_id, variants, tasks, file_path=None):
             print(f"[INFO][{task_id}] 整理结果中...")
             tasks[task_id]['result'] = {
                 'status': 'completed',
+                'transcript_policy': TRANSCRIPT_POLICY,
                 'variants': variants,
                 'summary': {
                     'variant_info': [v.get('variant_info') for v in variants],
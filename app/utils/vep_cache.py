@@ -0,0 +1,158 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from app.utils.gene_to_protein import VEP_CACHE_DIR, VEP_ASSEMBLY
+
+VEP_ANNOTATION_CACHE_DB = "data/cache/vep_annotation_cache.db"
+MAX_ENTRIES = 500000          # 超过后按最近使用时间淘汰
+EVICT_BATCH = 10000           # 每次淘汰的最少条数
+RECORD_SCHEMA = 2             # 缓存记录格式版本，记录字段变化时递增以清空旧缓存
+
+
+def detect_vep_version(cache_dir=VEP_CACHE_DIR, assembly=VEP_ASSEMBLY):
+    """
+    从 VEP 缓存目录推断缓存版本，如 ~/.vep/homo_sapiens/114_GRCh38 → '114_GRCh38'。
+    无法确定时返回 'unknown'。
+    """
+    species_dir = os.path.join(cache_dir, "homo_sapiens")
+    try:
+        versions = sorted(d for d in os.listdir(species_dir) if d.endswith(f"_{assembly}"))
+    except OSError:
+        return "unknown"
+    return versions[-1] if versions else "unknown"
+
+
+class VEPAnnotationCache:
+    """
+    以 (assembly, chrom, pos, ref, alt, VEP 版本) 为键的注释缓存，
+    值为 parse_vep_output 对该变异解析出的全部转录本记录
+    （protein_id, hgvs_p, canonical, mane_select, impact）。
+    VEP 缓存版本或记录格式变化时自动清空。
+    """
+
+    def __init__(self, db_path=VEP_ANNOTATION_CACHE_DB, vep_version=None, max_entries=MAX_ENTRIES):
+        self.db_path = db_path
+        self.vep_version = vep_version or detect_vep_version()
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = self._conn()
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS annotations (
+                    key TEXT PRIMARY KEY,
+                    records TEXT,
+                    last_used REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_annotations_last_used ON annotations(last_used)")
+            row = conn.execute("SELECT value FROM meta WHERE key = 'vep_version'").fetchone()
+            schema = conn.execute("SELECT value FROM meta WHERE key = 'record_schema'").fetchone()
+            if row is None or row[0] != self.vep_version or schema is None or schema[0] != str(RECORD_SCHEMA):
+                if row is not None:
+                    print(f"[INFO] VEP 缓存版本或记录格式变化 ({row[0]} → {self.vep_version})，清空注释缓存")
+                conn.execute("DELETE FROM annotations")
+                conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                 [('vep_version', self.vep_version), ('record_schema', str(RECORD_SCHEMA))])
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def make_key(self, chrom, pos, ref, alt):
+        chrom = str(chrom)
+        if chrom.lower().startswith("chr"):
+            chrom = chrom[3:]
+        return f"{VEP_ASSEMBLY}:{chrom}:{pos}:{ref}:{alt}:{self.vep_version}"
+
+    def get_many(self, keys, chunk_size=400):
+        """返回 {key: records}，只包含命中的键"""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        conn = self._conn()
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i + chunk_size]
+            placeholders = ",".join("?" for _ in chunk)
+            for key, records in conn.execute(
+                    f"SELECT key, records FROM annotations WHERE key IN ({placeholders})", chunk):
+                found[key] = json.loads(records)
+
+        if found:
+            now = time.time()
+            with conn:
+                conn.executemany("UPDATE annotations SET last_used = ? WHERE key = ?",
+                                 [(now, key) for key in found])
+        with self._stats_lock:
+            self._hits += len(found)
+            self._misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, entries):
+        """entries: {key: records}"""
+        if not entries:
+            return
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO annotations (key, records, last_used) VALUES (?, ?, ?)",
+                [(key, json.dumps(records), now) for key, records in entries.items()]
+            )
+        self._evict()
+
+    def _evict(self):
+        conn = self._conn()
+        count = conn.execute("SELECT COUNT(*) FROM annotations").fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        with conn:
+            conn.execute(
+                "DELETE FROM annotations WHERE key IN "
+                "(SELECT key FROM annotations ORDER BY last_used LIMIT ?)",
+                (max(excess, EVICT_BATCH),)
+            )
+
+    def invalidate(self):
+        """清空全部缓存（例如手动升级 VEP 缓存后）"""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM annotations")
+
+    def get_stats(self):
+        with self._stats_lock:
+            hits, misses = self._hits, self._misses
+        total = hits + misses
+        entries = self._conn().execute("SELECT COUNT(*) FROM annotations").fetchone()[0]
+        return {
+            'vep_version': self.vep_version,
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_vep_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = VEPAnnotationCache()
+        return _cache
@@ -0,0 +1,219 @@
+import collections
+import gzip
+import itertools
+import os
+import queue
+import subprocess
+import threading
+from app.utils.gene_to_protein import VEP_SCRIPT, vep_annotation_args, run_vep_sharded
+
+# 常驻 VEP 进程数；为 0 时始终使用子进程模式
+VEP_SERVER_WORKERS = int(os.environ.get("VEP_SERVER_WORKERS", "1"))
+# 超过该变异数的 VCF 走子进程模式（逐条缓冲会失去 VEP 的批处理效率）
+VEP_SERVER_MAX_VARIANTS = 500
+# 等待下一行输出的最长时间（秒）；首次请求包含 VEP 加载缓存的时间，单独放宽
+VEP_SERVER_TIMEOUT = int(os.environ.get("VEP_SERVER_TIMEOUT", "15"))
+VEP_SERVER_STARTUP_TIMEOUT = int(os.environ.get("VEP_SERVER_STARTUP_TIMEOUT", "120"))
+STDERR_TAIL_LINES = 20
+
+SENTINEL_PREFIX = "__vep_sentinel_"
+
+# 通过 perl 包装开启 STDOUT 自动刷新，使结果逐条返回
+_PERL_WRAPPER = 'use IO::Handle; STDOUT->autoflush(1); $0 = shift @ARGV; do $0; die $@ if $@;'
+
+
+def worker_command():
+    """常驻 VEP 进程的启动命令"""
+    return ["perl", "-e", _PERL_WRAPPER, VEP_SCRIPT] + vep_annotation_args() + [
+        "--format", "vcf",
+        "--buffer_size", "1",
+        "-o", "STDOUT",
+        "--force_overwrite",
+    ]
+
+
+class VEPWorker:
+    """
+    常驻的 VEP 进程：启动时加载缓存和 FASTA，此后通过标准输入接收 VCF 行，
+    从标准输出读取 TSV 注释。
+    VEP 的 VCF 解析器会预读一条记录，某条记录只有在下一行输入到达后才会输出。
+    因此每次请求后追加两个哨兵变异：读到第一个哨兵即表示本次请求结束，
+    第二个哨兵只用于把第一个“推”出来，它的输出会在下一次请求时读到并丢弃。
+    """
+
+    def __init__(self, cmd=None):
+        self.proc = subprocess.Popen(
+            cmd or worker_command(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        self.header_lines = []
+        self._lines = queue.Queue()
+        self._stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+        self._counter = itertools.count()
+        self._reader = threading.Thread(target=self._read_stdout, daemon=True)
+        self._reader.start()
+        self._err_reader = threading.Thread(target=self._read_stderr, daemon=True)
+        self._err_reader.start()
+
+    def _read_stdout(self):
+        for line in self.proc.stdout:
+            self._lines.put(line)
+        self._lines.put(None)
+
+    def _read_stderr(self):
+        for line in self.proc.stderr:
+            line = line.rstrip()
+            if line:
+                self._stderr_tail.append(line)
+                print(f"[DEBUG][vep-server] {line}")
+
+    def _failure(self, message):
+        tail = "\n".join(self._stderr_tail)
+        return RuntimeError(f"{message}；VEP stderr:\n{tail}" if tail else message)
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def annotate(self, vcf_lines, timeout=None):
+        """注释若干 VCF 数据行，返回 TSV 数据行列表（不含表头）"""
+        if not vcf_lines:
+            return []
+        if timeout is None:
+            timeout = VEP_SERVER_TIMEOUT if self.header_lines else VEP_SERVER_STARTUP_TIMEOUT
+        request = next(self._counter)
+        sentinel_id = f"{SENTINEL_PREFIX}{request}__"
+        chrom = vcf_lines[-1].split("\t", 1)[0]
+
+        for line in vcf_lines:
+            self.proc.stdin.write(line if line.endswith("\n") else line + "\n")
+        self.proc.stdin.write(f"{chrom}\t1\t{sentinel_id}\tN\tA\t.\t.\t.\n")
+        self.proc.stdin.write(f"{chrom}\t1\t{SENTINEL_PREFIX}{request}_flush__\tN\tA\t.\t.\t.\n")
+        self.proc.stdin.flush()
+
+        rows = []
+        while True:
+            try:
+                line = self._lines.get(timeout=timeout)
+            except queue.Empty:
+                raise self._failure(f"VEP 常驻进程 {timeout}s 内无输出") from None
+            if line is None:
+                raise self._failure("VEP 常驻进程意外退出")
+            if line.startswith("#"):
+                # 表头只在进程首次输出时出现，保存下来供每次请求复用
+                self.header_lines.append(line)
+                continue
+            var_id = line.split("\t", 1)[0]
+            if var_id == sentinel_id:
+                return rows
+            if var_id.startswith(SENTINEL_PREFIX):
+                # 上一次请求的哨兵（第二个哨兵或第一个哨兵的多余转录本行）
+                continue
+            rows.append(line)
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=10)
+        except Exception:
+            self.proc.kill()
+
+
+class VEPServerPool:
+    """常驻 VEP 进程池，每个进程一次只处理一个请求"""
+
+    def __init__(self, size=VEP_SERVER_WORKERS):
+        self.size = size
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.disabled = size <= 0
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return VEPWorker()
+                except Exception:
+                    self._created -= 1
+                    raise
+        return self._idle.get()
+
+    def _release(self, worker, healthy=True):
+        if healthy and worker.alive():
+            self._idle.put(worker)
+        else:
+            worker.close()
+            with self._lock:
+                self._created -= 1
+
+    def annotate_file(self, input_vcf, output_file):
+        """用常驻进程注释 input_vcf，按 parse_vep_output 可读取的格式写入 output_file"""
+        opener = gzip.open if input_vcf.endswith((".gz", ".bgz")) else open
+        with opener(input_vcf, "rt") as f:
+            vcf_lines = [line for line in f if line.strip() and not line.startswith("#")]
+
+        worker = self._acquire()
+        try:
+            rows = worker.annotate(vcf_lines)
+        except Exception:
+            self._release(worker, healthy=False)
+            raise
+        self._release(worker)
+
+        with open(output_file, "w") as out:
+            out.writelines(worker.header_lines)
+            out.writelines(rows)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_vep_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = VEPServerPool()
+        return _pool
+
+
+def _count_records(input_vcf, limit=None):
+    opener = gzip.open if input_vcf.endswith((".gz", ".bgz")) else open
+    count = 0
+    with opener(input_vcf, "rt") as f:
+        for line in f:
+            if line.strip() and not line.startswith("#"):
+                count += 1
+                if limit is not None and count > limit:
+                    break
+    return count
+
+
+def annotate_vcf(input_vcf, output_file, progress_callback=None):
+    """
+    优先使用常驻 VEP 进程注释小型 VCF（如 rsID 查询），
+    较大的 VCF 切分后由多个 VEP 子进程并行注释；
+    进程池不可用或出错时同样退回子进程模式。
+    """
+    pool = get_vep_pool()
+    if not pool.disabled and _count_records(input_vcf, VEP_SERVER_MAX_VARIANTS) <= VEP_SERVER_MAX_VARIANTS:
+        try:
+            pool.annotate_file(input_vcf, output_file)
+            print(f"[DEBUG] 使用常驻 VEP 进程完成注释: {output_file}")
+            if progress_callback:
+                progress_callback(1, 1)
+            return
+        except Exception as e:
+            print(f"[WARNING] 常驻 VEP 进程注释失败，改用子进程模式: {e}")
+            if not os.path.exists(VEP_SCRIPT):
+                pool.disabled = True
+    run_vep_sharded(input_vcf, output_file, _count_records(input_vcf), progress_callback=progress_callback)
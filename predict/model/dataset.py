@@ -1,16 +1,24 @@
 import torch
 import os
+import hashlib
+import shutil
 import sqlite3
+import threading
+import numpy as np
 import pyfaidx
 import pandas as pd
 from sklearn.preprocessing import LabelEncoder
 from torch.utils.data import Dataset
+from .genome import get_genome, N_BYTE
 
 
 # 配置参数
 DB_PATH = "./data/clinvar/brca_clinvar.db"
 FASTA_PATH = "data/GRCh38/Homo_sapiens.GRCh38.dna.primary_assembly.fa"
 TABLE_NAME = "brca_clinvar"
+# 预先编码的训练窗口，按数据库和 FASTA 的校验和分目录保存
+WINDOW_CACHE_DIR = "data/cache/windows"
+SHARD_BUILD_CHUNK = 4096
 MAX_SEQ_LENGTH = 1000  # 1kb序列
 CHAR_TO_INDEX = {'A': 0, 'C': 1, 'G': 2, 'T': 3, 'N': 4}
 
@@ -18,36 +26,74 @@ CHAR_TO_INDEX = {'A': 0, 'C': 1, 'G': 2, 'T': 3, 'N': 4}
 CHAR_TO_INDEX = {'A': 0, 'C': 1, 'G': 2, 'T': 3, 'N': 4}
 VOCAB_SIZE = len(CHAR_TO_INDEX) + 1  # +1 for padding index 0
 
-# 确保FASTA索引存在
-if not os.path.exists(FASTA_PATH + ".fai"):
-    pyfaidx.Faidx(FASTA_PATH)
+_fasta = None
+_fasta_lock = threading.Lock()
+
+
+def get_fasta():
+    """首次使用时打开 FASTA（仅在没有打包基因组时使用）"""
+    global _fasta
+    with _fasta_lock:
+        if _fasta is None:
+            # 确保FASTA索引存在
+            if not os.path.exists(FASTA_PATH + ".fai"):
+                pyfaidx.Faidx(FASTA_PATH)
+            _fasta = pyfaidx.Fasta(FASTA_PATH)
+        return _fasta
+
+
+def _n_window(window):
+    return np.full(window, N_BYTE, dtype=np.uint8)
+
+
+def window_start(pos, window=MAX_SEQ_LENGTH):
+    """变异窗口的起始坐标（1-based）"""
+    return max(1, int(round(pos)) - window // 2)
+
+
+def extract_span(chrom_id, start, end):
+    """
+    提取 [start, end]（1-based，闭区间）的序列，返回大写 ASCII 的 uint8 数组，
+    染色体末端处可能短于请求长度；找不到染色体时返回 None。
+    """
+    genome = get_genome(fasta_path=FASTA_PATH)
+    if genome is not None:
+        chrom = genome.resolve(chrom_id)
+        if chrom is None:
+            print(f"[WARN] Chromosome {chrom_id} not found in packed genome.")
+            return None
+        return genome.fetch(chrom, start - 1, end)
+
+    fasta = get_fasta()
+    chrom = str(chrom_id)
+    # 自动适配 FASTA 命名
+    if chrom not in fasta:
+        # 尝试去掉 chr 前缀再匹配
+        if chrom.startswith("chr") and chrom[3:] in fasta:
+            chrom = chrom[3:]
+        elif f"chr{chrom}" in fasta:
+            chrom = f"chr{chrom}"
+        else:
+            print(f"[WARN] Chromosome {chrom_id} not found in FASTA.")
+            return None
+
+    seq = fasta[chrom][start - 1:end]
+    return np.frombuffer(str(seq).upper().encode("ascii"), dtype=np.uint8)
 
-fasta = pyfaidx.Fasta(FASTA_PATH)
 
 def extract_region(chrom_id, pos, window=MAX_SEQ_LENGTH):
-    """提取基因组区域"""
+    """
+    提取基因组区域，返回大写 ASCII 的 uint8 数组。
+    存在打包基因组时返回内存映射数组的切片视图（零拷贝），否则从 FASTA 读取。
+    """
     try:
-        chrom = str(chrom_id)
-        # 自动适配 FASTA 命名
-        if chrom not in fasta:
-            # 尝试去掉 chr 前缀再匹配
-            if chrom.startswith("chr") and chrom[3:] in fasta:
-                chrom = chrom[3:]
-            elif f"chr{chrom}" in fasta:
-                chrom = f"chr{chrom}"
-            else:
-                print(f"[WARN] Chromosome {chrom_id} not found in FASTA.")
-                return "N" * window
-
-        pos = int(round(pos))  # 确保pos是整数
-        start = max(1, pos - window // 2)
-        end = start + window - 1
-        seq = fasta[chrom][start - 1:end]
-        return str(seq).upper()
+        start = window_start(pos, window)
+        seq = extract_span(chrom_id, start, start + window - 1)
+        return _n_window(window) if seq is None else seq
     
     except Exception as e:
         print(f"[ERROR] Failed to extract region for {chrom_id}:{pos} - {e}")
-        return "N" * window
+        return _n_window(window)
 
 
 # 从SQLite数据库读取数据
@@ -74,16 +120,6 @@ def preprocess_data(df):
     # 变异长度：这里用 ref 和 alt 长度差异来简单计算
     df['variant_length'] = df.apply(lambda row: max(len(str(row['ref'])), len(str(row['alt']))), axis=1)
 
-    print("Extracting genomic regions...")
-    df['genomic_region'] = df.apply(
-        lambda row: extract_region(
-            row['chrom'],
-            row['pos'],
-            window=MAX_SEQ_LENGTH
-        ),
-        axis=1
-    )
-    
     # 编码 clnsig（临床意义）标签
     print("Encoding clinical significance labels...")
     # 预定义所有可能的标签（包括你后续预测可能用到的）
@@ -107,20 +143,46 @@ def preprocess_data(df):
     gene_encoder = LabelEncoder()
     df['gene_encoded'] = gene_encoder.fit_transform(df['gene'].astype(str))
 
+    # 基因组窗口只提取和编码一次，写入内存映射分片；VariantDataset 按 shard_index 读取
+    shard = load_or_build_window_shard(df)
+    df['shard_index'] = np.arange(len(df), dtype=np.int64)
+    df.attrs['window_shard'] = shard.shard_dir
+
     return df, clnsig_encoder, gene_encoder
 
 
+# 256 项查找表：ASCII 字节 → 模型输入索引（CHAR_TO_INDEX + 1，0 留给 padding），未知字符按 N 处理
+ENCODE_LUT = np.full(256, CHAR_TO_INDEX['N'] + 1, dtype=np.uint8)
+for _char, _index in CHAR_TO_INDEX.items():
+    ENCODE_LUT[ord(_char)] = _index + 1
+
+
+def _as_bytes(sequence):
+    if isinstance(sequence, np.ndarray):
+        return sequence
+    return np.frombuffer(sequence.encode("ascii", "replace"), dtype=np.uint8)
+
+
+def encode_sequences(sequences, length=MAX_SEQ_LENGTH):
+    """
+    将一批序列（字符串或 uint8 数组）截断/用 N 填充到 length，
+    查表编码为 (B, length) 的 uint8 索引数组。
+    """
+    buf = np.full((len(sequences), length), N_BYTE, dtype=np.uint8)
+    for i, sequence in enumerate(sequences):
+        data = _as_bytes(sequence)[:length]
+        buf[i, :len(data)] = data
+    return ENCODE_LUT[buf]
+
+
+def dna_batch_to_tensor(sequences, length=MAX_SEQ_LENGTH):
+    """将一批DNA序列转换为连续的 (B, length) LongTensor"""
+    return torch.from_numpy(encode_sequences(sequences, length)).long()
+
+
 def dna_to_tensor(sequence):
-    """将DNA序列转换为PyTorch张量"""
-    # 截断或填充序列到固定长度
-    if len(sequence) > MAX_SEQ_LENGTH:
-        sequence = sequence[:MAX_SEQ_LENGTH]
-    elif len(sequence) < MAX_SEQ_LENGTH:
-        sequence = sequence + 'N' * (MAX_SEQ_LENGTH - len(sequence))
-    
-    # 转换为索引序列
-    indices = [CHAR_TO_INDEX.get(c, CHAR_TO_INDEX['N']) + 1 for c in sequence]
-    return torch.tensor(indices, dtype=torch.long)
+    """将DNA序列（字符串或 extract_region 返回的 uint8 数组）转换为PyTorch张量"""
+    return dna_batch_to_tensor([sequence])[0]
 
 
 def get_variant_mask(pos, chrom_seq_start, window=MAX_SEQ_LENGTH):
@@ -133,30 +195,134 @@ def get_variant_mask(pos, chrom_seq_start, window=MAX_SEQ_LENGTH):
     return mask
 
 
+def _update_file_digest(h, path):
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+
+
+def window_shard_key(db_path=DB_PATH, fasta_path=FASTA_PATH, window=MAX_SEQ_LENGTH):
+    """
+    窗口分片的键：数据库内容的 SHA1 + FASTA 的 .fai 索引与文件大小 + 窗口长度。
+    FASTA 体积较大，用 .fai（记录每条染色体的长度和偏移）代替全文校验。
+    """
+    h = hashlib.sha1()
+    _update_file_digest(h, db_path)
+    if os.path.exists(fasta_path + ".fai"):
+        _update_file_digest(h, fasta_path + ".fai")
+    if os.path.exists(fasta_path):
+        h.update(str(os.path.getsize(fasta_path)).encode())
+    else:
+        genome = get_genome(fasta_path=fasta_path)
+        h.update(str(genome.source if genome else "").encode())
+    h.update(f"window={window};lut={ENCODE_LUT.tobytes().hex()}".encode())
+    return h.hexdigest()
+
+
+class WindowShard:
+    """
+    预编码的训练窗口：seqs.npy 为 (N, L) 的 uint8 索引数组（内存映射），
+    arrays.npz 保存与之平行的 pos / gene_ids / labels / scores。
+    序列化到 DataLoader 子进程时只传目录，子进程各自重新映射。
+    """
+
+    def __init__(self, shard_dir):
+        self.shard_dir = shard_dir
+        with np.load(os.path.join(shard_dir, "arrays.npz")) as arrays:
+            self.pos = arrays["pos"]
+            self.gene_ids = arrays["gene_ids"]
+            self.labels = arrays["labels"]
+            self.scores = arrays["scores"]
+        self._seqs = None
+
+    @property
+    def seqs(self):
+        if self._seqs is None:
+            self._seqs = np.load(os.path.join(self.shard_dir, "seqs.npy"), mmap_mode="r")
+        return self._seqs
+
+    def __len__(self):
+        return len(self.pos)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_seqs"] = None
+        return state
+
+    @classmethod
+    def build(cls, df, shard_dir, window=MAX_SEQ_LENGTH):
+        """逐块提取并编码 df 中每个变异的窗口，原子地写入 shard_dir"""
+        tmp_dir = shard_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        chroms = df['chrom'].tolist()
+        positions = df['pos'].to_numpy()
+        seqs = np.lib.format.open_memmap(
+            os.path.join(tmp_dir, "seqs.npy"), mode="w+", dtype=np.uint8, shape=(len(df), window))
+        for start in range(0, len(df), SHARD_BUILD_CHUNK):
+            end = min(start + SHARD_BUILD_CHUNK, len(df))
+            windows = [extract_region(chroms[i], positions[i], window=window) for i in range(start, end)]
+            seqs[start:end] = encode_sequences(windows, window)
+        seqs.flush()
+        del seqs
+
+        np.savez(
+            os.path.join(tmp_dir, "arrays.npz"),
+            pos=positions.astype(np.int64),
+            gene_ids=df['gene_encoded'].to_numpy(dtype=np.int64),
+            labels=df['clnsig_label'].to_numpy(dtype=np.int64),
+            scores=df['score'].to_numpy(dtype=np.float32),
+        )
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        os.replace(tmp_dir, shard_dir)
+        return cls(shard_dir)
+
+
+def load_or_build_window_shard(df, cache_dir=WINDOW_CACHE_DIR):
+    """读取与当前数据库和 FASTA 对应的窗口分片；不存在或与 df 不一致时重新构建"""
+    shard_dir = os.path.join(cache_dir, window_shard_key()[:16])
+    if os.path.exists(os.path.join(shard_dir, "arrays.npz")):
+        shard = WindowShard(shard_dir)
+        if len(shard) == len(df) and np.array_equal(shard.pos, df['pos'].to_numpy(dtype=np.int64)):
+            print(f"Using cached genomic windows: {shard_dir}")
+            return shard
+    print("Extracting genomic regions...")
+    os.makedirs(cache_dir, exist_ok=True)
+    return WindowShard.build(df, shard_dir)
+
+
 # 自定义数据集类
 class VariantDataset(Dataset):
-    def __init__(self, dataframe, use_gene_encoding=False, use_mask=False):
-        self.data = dataframe.reset_index(drop=True)
+    """
+    直接按 shard_index 读取预编码窗口分片，不再持有 DataFrame，
+    避免每个样本 iloc 和向 DataLoader 子进程复制整张表。
+    """
+
+    def __init__(self, dataframe, use_gene_encoding=False, use_mask=False, shard=None):
+        self.shard = shard or WindowShard(dataframe.attrs['window_shard'])
+        self.indices = dataframe['shard_index'].to_numpy(dtype=np.int64)
         self.use_gene = use_gene_encoding
         self.use_mask = use_mask
 
     def __len__(self):
-        return len(self.data)
+        return len(self.indices)
 
     def __getitem__(self, idx):
-        row = self.data.iloc[idx]
-        seq = dna_to_tensor(row['genomic_region'])
-        score = torch.tensor(row['score'], dtype=torch.float32)
+        i = self.indices[idx]
+        seq = torch.from_numpy(self.shard.seqs[i].astype(np.int64))
+        score = torch.tensor(self.shard.scores[i], dtype=torch.float32)
 
         # 默认占位
         gene_id = None
         variant_mask = None
 
         if self.use_gene:
-            gene_id = torch.tensor(int(row['gene_encoded']), dtype=torch.long)
+            gene_id = torch.tensor(int(self.shard.gene_ids[i]), dtype=torch.long)
         
         if self.use_mask:
-            variant_mask = get_variant_mask(row['pos'], row['pos'] - MAX_SEQ_LENGTH // 2)
+            pos = int(self.shard.pos[i])
+            variant_mask = get_variant_mask(pos, pos - MAX_SEQ_LENGTH // 2)
 
         # 返回 tuple，顺序固定：
         if gene_id is not None and variant_mask is not None:
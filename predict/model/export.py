@@ -0,0 +1,110 @@
+import copy
+import os
+import sys
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval, fuse_linear_bn_eval
+
+# 导出产物与 best_model.pth 放在同一目录
+TORCHSCRIPT_SUFFIX = ".ts"
+ONNX_SUFFIX = ".onnx"
+EXAMPLE_BATCH = 4
+PARITY_ATOL = 1e-4
+
+
+def artifact_path(model_path, suffix):
+    """best_model.pth → best_model.ts / best_model.onnx"""
+    return os.path.splitext(model_path)[0] + suffix
+
+
+def is_stale(artifact, model_path):
+    """导出产物不存在或比权重文件旧时需要重新导出"""
+    return not os.path.exists(artifact) or os.path.getmtime(artifact) < os.path.getmtime(model_path)
+
+
+def _tmp_path(path):
+    """与目标文件同目录、同后缀的临时路径，写完后 os.replace 到位，其他进程不会读到写了一半的文件"""
+    root, suffix = os.path.splitext(path)
+    return f"{root}.tmp-{os.getpid()}{suffix}"
+
+
+def fold_batchnorm(model):
+    """
+    返回一个 eval 模式的副本：conv1/bn1、conv2/bn2、fc1/bn3 合并为单层，
+    BatchNorm 替换为 Identity。原模型不变。
+    """
+    fused = copy.deepcopy(model).eval()
+    fused.conv1 = fuse_conv_bn_eval(fused.conv1, fused.bn1)
+    fused.conv2 = fuse_conv_bn_eval(fused.conv2, fused.bn2)
+    fused.fc1 = fuse_linear_bn_eval(fused.fc1, fused.bn3)
+    fused.bn1 = nn.Identity()
+    fused.bn2 = nn.Identity()
+    fused.bn3 = nn.Identity()
+    return fused
+
+
+def example_inputs(model, batch_size=EXAMPLE_BATCH, seq_len=1000, vocab_size=6):
+    """导出和一致性检查使用的随机输入 (seq, gene, mask)，变异位于序列中心"""
+    generator = torch.Generator().manual_seed(0)
+    seq = torch.randint(1, vocab_size, (batch_size, seq_len), generator=generator)
+    num_genes = model.gene_embedding.num_embeddings if model.use_gene else 1
+    gene = torch.randint(0, num_genes, (batch_size,), generator=generator)
+    mask = torch.zeros(batch_size, seq_len)
+    mask[:, seq_len // 2] = 1.0
+    return seq, gene, mask
+
+
+def export_torchscript(model, path, seq_len=1000):
+    """合并 BatchNorm 后 trace 并 freeze，保存为 TorchScript"""
+    fused = fold_batchnorm(model).cpu()
+    inputs = example_inputs(fused, seq_len=seq_len)
+    with torch.no_grad():
+        traced = torch.jit.trace(fused, inputs)
+    frozen = torch.jit.freeze(traced)
+    tmp_path = _tmp_path(path)
+    frozen.save(tmp_path)
+    os.replace(tmp_path, path)
+    print(f"[INFO] TorchScript 模型已导出: {path}")
+    return path
+
+
+def export_onnx(model, path, seq_len=1000):
+    """合并 BatchNorm 后导出 ONNX（batch 维为动态维度）"""
+    fused = fold_batchnorm(model).cpu()
+    inputs = example_inputs(fused, seq_len=seq_len)
+    tmp_path = _tmp_path(path)
+    torch.onnx.export(
+        fused, inputs, tmp_path,
+        input_names=["seq", "gene", "variant_mask"],
+        output_names=["score"],
+        dynamic_axes={"seq": {0: "batch"}, "gene": {0: "batch"},
+                      "variant_mask": {0: "batch"}, "score": {0: "batch"}},
+        opset_version=17,
+        dynamo=False,
+    )
+    os.replace(tmp_path, path)
+    print(f"[INFO] ONNX 模型已导出: {path}")
+    return path
+
+
+def max_abs_diff(reference, candidate, inputs):
+    """对同一组输入比较两个模型的输出，返回最大绝对误差"""
+    with torch.inference_mode():
+        expected = reference(*inputs)
+        actual = candidate(*inputs)
+    return float((expected - actual).abs().max())
+
+
+if __name__ == "__main__":
+    # 用法: python -m predict.model.export [torchscript|onnx]
+    from app.utils.predict import load_model, MODEL_PATH
+
+    backend = sys.argv[1] if len(sys.argv) > 1 else "torchscript"
+    model, _ = load_model()
+    model = model.cpu()
+    if backend == "onnx":
+        export_onnx(model, artifact_path(MODEL_PATH, ONNX_SUFFIX))
+    else:
+        path = export_torchscript(model, artifact_path(MODEL_PATH, TORCHSCRIPT_SUFFIX))
+        diff = max_abs_diff(model, torch.jit.load(path), example_inputs(model))
+        print(f"[INFO] 与 eager 模型的最大误差: {diff:.2e}")
@@ -0,0 +1,135 @@
+import json
+import os
+import shutil
+import sys
+import threading
+import numpy as np
+
+# 打包后的基因组：每条染色体一个 uint8 数组（大写 ASCII，每个碱基 1 字节），
+# 以 .npy 保存并通过内存映射读取，多进程共享页缓存
+PACKED_GENOME_DIR = "data/GRCh38/packed"
+MANIFEST_NAME = "genome.json"
+CONVERT_CHUNK = 10_000_000  # 转换时每次从 FASTA 读取的碱基数
+
+N_BYTE = ord('N')
+
+
+def _source_signature(fasta_path):
+    stat = os.stat(fasta_path)
+    return f"{int(stat.st_mtime)}:{stat.st_size}"
+
+
+def pack_genome(fasta_path, out_dir=PACKED_GENOME_DIR):
+    """
+    将 FASTA 转换为按染色体存放的 uint8 数组，清单中记录 FASTA 的签名。
+    先写入临时目录，完成后整体替换 out_dir：已映射旧文件的进程继续读取旧数据，
+    不会读到写了一半的数组。
+    """
+    import pyfaidx
+
+    out_dir = os.path.normpath(out_dir)
+    tmp_dir = f"{out_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    fasta = pyfaidx.Fasta(fasta_path)
+    chroms = {}
+    for name in fasta.keys():
+        length = len(fasta[name])
+        seq_path = os.path.join(tmp_dir, f"{name}.npy")
+        seq = np.lib.format.open_memmap(seq_path, mode="w+", dtype=np.uint8, shape=(length,))
+        for start in range(0, length, CONVERT_CHUNK):
+            end = min(start + CONVERT_CHUNK, length)
+            text = str(fasta[name][start:end]).upper()
+            seq[start:end] = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+        seq.flush()
+        chroms[name] = length
+        print(f"[INFO] 已打包染色体 {name}: {length} bp")
+        del seq
+
+    with open(os.path.join(tmp_dir, MANIFEST_NAME), "w") as f:
+        json.dump({"source": _source_signature(fasta_path), "chroms": chroms}, f)
+
+    # 目录不能直接覆盖非空目录：先移走旧目录，再把新目录换到原位置
+    old_dir = f"{out_dir}.old-{os.getpid()}"
+    if os.path.exists(out_dir):
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return PackedGenome(out_dir)
+
+
+class PackedGenome:
+    """
+    内存映射的打包基因组。fetch 返回的窗口是底层数组的切片视图，不复制数据。
+    """
+
+    def __init__(self, packed_dir=PACKED_GENOME_DIR):
+        self.packed_dir = packed_dir
+        with open(os.path.join(packed_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        self.source = manifest.get("source")
+        self.lengths = manifest["chroms"]
+        self._seqs = {}
+
+    def __contains__(self, chrom):
+        return chrom in self.lengths
+
+    def resolve(self, chrom_id):
+        """自动适配 chr 前缀，找不到时返回 None"""
+        chrom = str(chrom_id)
+        if chrom in self.lengths:
+            return chrom
+        if chrom.startswith("chr") and chrom[3:] in self.lengths:
+            return chrom[3:]
+        if f"chr{chrom}" in self.lengths:
+            return f"chr{chrom}"
+        return None
+
+    def sequence(self, chrom):
+        seq = self._seqs.get(chrom)
+        if seq is None:
+            seq = np.load(os.path.join(self.packed_dir, f"{chrom}.npy"), mmap_mode="r")
+            self._seqs[chrom] = seq
+        return seq
+
+    def fetch(self, chrom, start, end):
+        """返回 [start, end) 区间（0-based）的 uint8 视图"""
+        return self.sequence(chrom)[start:end]
+
+
+_genome = None
+_genome_checked = False
+_genome_lock = threading.Lock()
+
+
+def get_genome(packed_dir=PACKED_GENOME_DIR, fasta_path=None):
+    """
+    返回打包基因组；目录不存在时返回 None，由调用方退回读取 FASTA。
+    给出 fasta_path 且该文件存在时校验清单中的签名：FASTA 已变化时不在服务进程中重新打包，
+    只给出警告并返回 None（改用 FASTA），需离线运行 python -m predict.model.genome 更新。
+    """
+    global _genome, _genome_checked
+    if _genome_checked:
+        return _genome
+    with _genome_lock:
+        if not _genome_checked:
+            if os.path.exists(os.path.join(packed_dir, MANIFEST_NAME)):
+                try:
+                    genome = PackedGenome(packed_dir)
+                    if (fasta_path and os.path.exists(fasta_path)
+                            and genome.source != _source_signature(fasta_path)):
+                        print(f"[WARNING] 打包基因组与 {fasta_path} 不一致，改用 FASTA；"
+                              f"请运行 python -m predict.model.genome {fasta_path} 重新打包")
+                    else:
+                        _genome = genome
+                except Exception as e:
+                    print(f"[WARNING] 打包基因组读取失败，改用 FASTA: {e}")
+            _genome_checked = True
+        return _genome
+
+
+if __name__ == "__main__":
+    # 用法: python -m predict.model.genome <fasta> [输出目录]
+    fasta_path = sys.argv[1]
+    out_dir = sys.argv[2] if len(sys.argv) > 2 else PACKED_GENOME_DIR
+    pack_genome(fasta_path, out_dir)
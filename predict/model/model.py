@@ -48,9 +48,16 @@ class VariantClassifier(nn.Module):
             x = self.pool(x)
             return x.view(1, -1).size(1)
 
-    def forward(self, seq, gene=None, variant_mask=None):
+    def conv1_block(self, seq):
+        """embedding + conv1/bn1/relu，逐位置计算，可在合并区域上共享"""
         x = self.seq_embedding(seq).permute(0, 2, 1)
-        x = F.relu(self.bn1(self.conv1(x)))
+        return F.relu(self.bn1(self.conv1(x)))
+
+    def forward(self, seq, gene=None, variant_mask=None):
+        return self.forward_from_conv1(self.conv1_block(seq), gene, variant_mask)
+
+    def forward_from_conv1(self, x, gene=None, variant_mask=None):
+        """从 conv1_block 的输出 (B, 32, L) 继续计算到最终得分"""
         x = self.pool(x)
         x = F.relu(self.bn2(self.conv2(x)))
         x = self.pool(x)
@@ -0,0 +1,149 @@
+import copy
+import io
+import sqlite3
+import sys
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from .dataset import DB_PATH, TABLE_NAME, MAX_SEQ_LENGTH, extract_region, dna_batch_to_tensor
+from .export import fold_batchnorm
+
+# 'dynamic'：仅 Linear 动态量化为 int8，无需校准
+# 'static'：FX 图模式静态量化 Conv1d 和 Linear，使用 brca_clinvar.db 中的样本校准
+QUANTIZE_MODES = ('none', 'dynamic', 'static')
+CALIBRATION_SIZE = 256
+CALIBRATION_BATCH = 64
+CALIBRATION_SEED = 42
+QUANT_ENGINE = 'x86'
+
+
+def load_calibration_set(gene_encoder, size=CALIBRATION_SIZE, db_path=DB_PATH, seed=CALIBRATION_SEED):
+    """
+    从 brca_clinvar.db 随机抽取 size 个有评分的变异，
+    返回 (seq, gene, mask, score) 张量，变异位于窗口中心。
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            f"SELECT DISTINCT chrom, pos, gene, score FROM {TABLE_NAME} WHERE score IS NOT NULL"
+        ).fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        raise ValueError(f"{db_path} 中没有可用于校准的变异")
+
+    rng = np.random.default_rng(seed)
+    picked = rng.choice(len(rows), size=min(size, len(rows)), replace=False)
+    rows = [rows[i] for i in sorted(picked)]
+
+    classes = set(gene_encoder.classes_) if gene_encoder is not None else set()
+    seq = dna_batch_to_tensor([extract_region(chrom, pos, window=MAX_SEQ_LENGTH) for chrom, pos, _, _ in rows])
+    gene = torch.tensor(
+        [int(gene_encoder.transform([g])[0]) if g in classes else 0 for _, _, g, _ in rows], dtype=torch.long)
+    mask = torch.zeros(len(rows), MAX_SEQ_LENGTH)
+    mask[:, MAX_SEQ_LENGTH // 2] = 1.0
+    score = torch.tensor([float(s) for _, _, _, s in rows], dtype=torch.float32)
+    return seq, gene, mask, score
+
+
+def _batches(calibration, batch_size=CALIBRATION_BATCH):
+    seq, gene, mask = calibration[:3]
+    for start in range(0, len(seq), batch_size):
+        yield seq[start:start + batch_size], gene[start:start + batch_size], mask[start:start + batch_size]
+
+
+def quantize_model(model, mode='dynamic', calibration=None):
+    """
+    返回 int8 量化后的 CPU 模型副本（先合并 BatchNorm）。
+    static 模式需要 calibration（load_calibration_set 的返回值）。
+    """
+    if mode not in QUANTIZE_MODES or mode == 'none':
+        raise ValueError(f"未知的量化模式: {mode}")
+    torch.backends.quantized.engine = QUANT_ENGINE
+    fused = fold_batchnorm(copy.deepcopy(model).cpu())
+
+    if mode == 'dynamic':
+        quantized = torch.ao.quantization.quantize_dynamic(fused, {nn.Linear}, dtype=torch.qint8)
+    else:
+        if calibration is None:
+            raise ValueError("静态量化需要校准数据")
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+        # Embedding 保持浮点，其余 Conv1d / Linear 量化为 int8
+        qconfig_mapping = get_default_qconfig_mapping(QUANT_ENGINE).set_object_type(nn.Embedding, None)
+        example = next(_batches(calibration))
+        prepared = prepare_fx(fused, qconfig_mapping, example)
+        with torch.inference_mode():
+            for batch in _batches(calibration):
+                prepared(*batch)
+        quantized = convert_fx(prepared)
+
+    quantized.use_gene = model.use_gene
+    quantized.eval()
+    return quantized
+
+
+def model_size_bytes(model):
+    """序列化 state_dict 的字节数（量化后的打包权重不计入 parameters()）"""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+
+def _predict(model, calibration, batch_size=CALIBRATION_BATCH):
+    with torch.inference_mode():
+        return torch.cat([model(*batch) for batch in _batches(calibration, batch_size)]).clamp(0, 1)
+
+
+def _batch_latency(model, calibration, repeats=10, batch_size=CALIBRATION_BATCH):
+    batch = next(_batches(calibration, batch_size))
+    with torch.inference_mode():
+        model(*batch)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(*batch)
+    return (time.perf_counter() - start) / repeats
+
+
+def quantization_report(float_model, quantized_model, calibration, label_fn=None):
+    """
+    在校准集上比较浮点与量化模型：输出差异、相对真实评分的 MSE 变化、
+    标签一致率、模型大小和每批推理耗时。
+    """
+    float_model = copy.deepcopy(float_model).cpu().eval()
+    expected = _predict(float_model, calibration)
+    actual = _predict(quantized_model, calibration)
+    score = calibration[3]
+    mse_float = float(((expected - score) ** 2).mean())
+    mse_quant = float(((actual - score) ** 2).mean())
+
+    report = {
+        'samples': len(score),
+        'max_abs_diff': float((expected - actual).abs().max()),
+        'mean_abs_diff': float((expected - actual).abs().mean()),
+        'mse_float': mse_float,
+        'mse_quantized': mse_quant,
+        'mse_delta': mse_quant - mse_float,
+        'size_float_bytes': model_size_bytes(float_model),
+        'size_quantized_bytes': model_size_bytes(quantized_model),
+        'batch_latency_float_ms': _batch_latency(float_model, calibration) * 1000,
+        'batch_latency_quantized_ms': _batch_latency(quantized_model, calibration) * 1000,
+    }
+    if label_fn is not None:
+        agree = sum(label_fn(a) == label_fn(b) for a, b in zip(expected.tolist(), actual.tolist()))
+        report['label_agreement'] = agree / len(score)
+    return report
+
+
+if __name__ == "__main__":
+    # 用法: python -m predict.model.quantize [dynamic|static]
+    from app.utils.predict import load_model, _score_to_label
+
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'dynamic'
+    model, gene_encoder = load_model()
+    calibration = load_calibration_set(gene_encoder)
+    quantized = quantize_model(model, mode, calibration)
+    for key, value in quantization_report(model, quantized, calibration, _score_to_label).items():
+        print(f"{key}: {value}")
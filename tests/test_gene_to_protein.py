@@ -0,0 +1,31 @@
+import threading
+from concurrent.futures import Future
+
+from app.utils import gene_to_protein
+
+
+class _ImmediateExecutor:
+    """submit 返回已完成的 future，模拟 LRU / 本地序列库命中时的快速查询"""
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+def test_prefetch_with_already_done_future_does_not_deadlock(monkeypatch):
+    monkeypatch.setattr(gene_to_protein, "_get_prefetch_executor", lambda: _ImmediateExecutor())
+    monkeypatch.setattr(gene_to_protein, "get_uniprot_seq", lambda accession: f"SEQ_{accession}")
+
+    result = {}
+    worker = threading.Thread(
+        target=lambda: result.update(gene_to_protein.prefetch_uniprot_seqs(["P38398", "P51587", "P38398"])),
+        daemon=True,
+    )
+    worker.start()
+    worker.join(timeout=5)
+
+    assert not worker.is_alive(), "prefetch_uniprot_seqs 在 future 已完成时死锁"
+    assert result == {"P38398": "SEQ_P38398", "P51587": "SEQ_P51587"}
+    # 完成回调已清理正在进行的请求
+    assert gene_to_protein._prefetch_inflight == {}
@@ -0,0 +1,50 @@
+import json
+
+import numpy as np
+
+from app.utils import predict, score_table
+
+
+class _NoForwardModel:
+    """得分表全部命中时不应调用模型"""
+
+    use_gene = True
+
+    def __call__(self, *args, **kwargs):
+        raise AssertionError("得分表命中时不应调用模型")
+
+
+def _write_table(table_dir, model_key, gene_index, chrom, start, scores):
+    np.save(table_dir / "BRCA1.npy", np.asarray(scores, dtype=np.float32))
+    manifest = {
+        'format': score_table.TABLE_FORMAT,
+        'model_key': model_key,
+        'gene_index': gene_index,
+        'flank': 0,
+        'genes': {'BRCA1': {'chrom': chrom, 'start': start, 'length': len(scores), 'file': 'BRCA1.npy'}},
+    }
+    (table_dir / score_table.MANIFEST_NAME).write_text(json.dumps(manifest))
+
+
+def test_predict_variants_hits_table_for_process_vcf_output(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    table_dir = tmp_path / "score_table"
+    table_dir.mkdir()
+    model_key = "checksum:eager:none"
+    _write_table(table_dir, model_key, predict._encode_gene(None, None), "17", 1000, [0.1, 0.2, 0.3, 0.4])
+
+    model = _NoForwardModel()
+    monkeypatch.setitem(predict._MODEL_REGISTRY, 'model', model)
+    monkeypatch.setitem(predict._MODEL_REGISTRY, 'cache_key', model_key)
+    monkeypatch.setattr(predict, 'get_score_table', lambda key: score_table.get_score_table(key, str(table_dir)))
+    monkeypatch.setattr(predict, 'get_prediction_cache', lambda key: None)
+
+    # 与 process_vcf 的输出结构相同：variant_info 中没有 'gene'
+    variants = [
+        {'variant_info': {'id': 'rs1', 'chrom': 'chr17', 'pos': 1001, 'ref': 'A', 'alt': 'G', 'genotype': 'A/G'}},
+        {'variant_info': {'id': '17:1003', 'chrom': '17', 'pos': 1003, 'ref': 'C', 'alt': 'T', 'genotype': 'NA'}},
+    ]
+    scores = predict.predict_variants(model, None, variants)
+
+    assert np.allclose(scores, [0.2, 0.4])
+    assert np.isclose(variants[0]['predict_result']['predict_score'], 0.2)
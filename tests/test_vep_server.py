@@ -0,0 +1,51 @@
+import sys
+import textwrap
+import time
+
+from app.utils.vep_server import VEPWorker
+
+# 模拟 VEP 的 VCF 解析器（ensembl-io TextParser）：预读一条记录，
+# 某条记录只有在下一行输入到达（或输入结束）后才输出注释
+FAKE_VEP = textwrap.dedent("""
+    import sys
+
+    header_written = False
+    pending = None
+
+    def emit(line):
+        global header_written
+        if not header_written:
+            sys.stdout.write("## fake VEP\\n")
+            sys.stdout.write("#Uploaded_variation\\tLocation\\tAllele\\n")
+            header_written = True
+        chrom, pos, var_id, ref, alt = line.split("\\t")[:5]
+        sys.stdout.write(f"{var_id}\\t{chrom}:{pos}\\t{alt}\\n")
+        sys.stdout.flush()
+
+    for line in sys.stdin:
+        if pending is not None:
+            emit(pending)
+        pending = line
+    if pending is not None:
+        emit(pending)
+""")
+
+
+def _vcf_line(chrom, pos, var_id):
+    return f"{chrom}\t{pos}\t{var_id}\tA\tG\t.\t.\t.\n"
+
+
+def test_worker_returns_without_waiting_for_next_request(tmp_path):
+    fake = tmp_path / "fake_vep.py"
+    fake.write_text(FAKE_VEP)
+    worker = VEPWorker(cmd=[sys.executable, str(fake)])
+    try:
+        for request, var_id in enumerate(("rs1", "rs2", "rs3")):
+            start = time.perf_counter()
+            rows = worker.annotate([_vcf_line("17", 43000000 + request, var_id)], timeout=5)
+            assert time.perf_counter() - start < 2
+            # 上一次请求遗留的哨兵行不会混入结果
+            assert [row.split("\t", 1)[0] for row in rows] == [var_id]
+        assert worker.header_lines[-1].startswith("#Uploaded_variation")
+    finally:
+        worker.close()